@@ -18,12 +18,16 @@ bl_info = {
 try:
     import bpy
     from .npr_face_shader.interface import *
+    from .npr_face_shader import workers
 
     classes = [
         FaceShadeProps,
         ComputeFaceShadows,
+        BatchComputeFaceShadows,
+        ComputeAnimatedFaceShadows,
         CreateMaterialOnly,
         CreateNodeGroupOnly,
+        ExportBakeBundle,
         FaceShadePanel,
     ]
 except ImportError as e:
@@ -36,6 +40,7 @@ def register():
     bpy.types.Object.face_shade_props = bpy.props.PointerProperty(type=FaceShadeProps)
 
 def unregister():
+    workers.close_worker_pool()
     try:
         del bpy.types.Object.face_shade_props
     except AttributeError:
@@ -0,0 +1,607 @@
+from typing import Callable, Optional
+from dataclasses import dataclass, fields, replace
+from multiprocessing.pool import Pool
+import tempfile
+
+from .utils import *
+from .workers import map_pixels, map_shared, get_worker_count
+from .blur import blur_image
+from .tiled import render_tiled, DEFAULT_TILE_SIZE
+from .symmetric import SYMMETRY_TOLERANCE, MAX_MIRRORED_SHARE, get_symmetry_error, symmetrize_intersections
+from .symmetric import find_shape_regions, count_symmetric_pixels, render_symmetric
+from .cache import StageCache, stage_cache, content_hash, DEFAULT_MAX_BYTES
+from .disk_cache import DiskCache
+from .profiling import BakeProfiler
+
+# everything below only needs numpy, so bakes can also run outside of blender
+
+
+@dataclass
+class StrokeGroup:
+    # points of every stroke of one grease pencil object, in its local space
+    strokes: list[npt.NDArray[np.float32]]
+    matrix_world: npt.NDArray[np.float64]
+
+
+@dataclass
+class BakeInputs:
+    mesh: TriangleMesh
+    mesh_matrix_world: npt.NDArray[np.float64]
+    lines: StrokeGroup
+    shadow_shapes: StrokeGroup
+    highlight_shapes: StrokeGroup
+    uv_map_name: str = ''
+
+
+@dataclass
+class BakeSettings:
+    width: int
+    height: int
+    blur_size: int = 25
+    blur_type: str = 'BOX'
+    blur_edge: str = 'ZERO'
+    engine: str = 'NUMPY'
+    exact_face_lookup: bool = False
+    precision: str = 'DOUBLE'
+    use_tiles: bool = False
+    tile_size: int = DEFAULT_TILE_SIZE
+    # how far simplified strokes may stray from the drawn ones in output texels, 0 keeps every point
+    simplify_tolerance: float = 0.0
+    # size in texels of the image the tolerance is measured in, 0 for this bake's own size
+    simplify_size: int = 0
+    # OFF, DETECT (mirror the map when the lines mirror each other) or MIRROR (make them mirror each other)
+    symmetry: str = 'OFF'
+
+
+STROKE_GROUP_NAMES = ['lines', 'shadow_shapes', 'highlight_shapes']
+
+
+class BakeCancelled(Exception):
+    # raised from a report or progress callback to stop a bake at the next stage or tile
+    pass
+
+
+def save_bundle(path: str, inputs: BakeInputs, settings: BakeSettings) -> None:
+    # strokes have different lengths, so each group is stored as one point array plus the stroke lengths
+    arrays = {
+        'mesh_positions': inputs.mesh.positions,
+        'mesh_uvs': inputs.mesh.uvs,
+        'mesh_matrix_world': inputs.mesh_matrix_world,
+        'uv_map_name': np.array(inputs.uv_map_name),
+    }
+    for name in STROKE_GROUP_NAMES:
+        group: StrokeGroup = getattr(inputs, name)
+        arrays[f'{name}_points'] = np.concatenate(group.strokes).astype(np.float32) \
+            if group.strokes else np.empty((0, 3), dtype=np.float32)
+        arrays[f'{name}_lengths'] = np.array([len(points) for points in group.strokes], dtype=np.int64)
+        arrays[f'{name}_matrix_world'] = group.matrix_world
+    for field in fields(settings):
+        arrays[f'settings_{field.name}'] = np.array(getattr(settings, field.name))
+    np.savez_compressed(path, **arrays)
+
+def load_bundle(path: str) -> tuple[BakeInputs, BakeSettings]:
+    with np.load(path) as data:
+        def load_strokes(name: str) -> list[npt.NDArray[np.float32]]:
+            # splitting an empty group would give one empty stroke instead of none
+            lengths = data[f'{name}_lengths']
+            return np.split(data[f'{name}_points'], np.cumsum(lengths)[:-1]) if len(lengths) else []
+
+        groups = {
+            name: StrokeGroup(strokes=load_strokes(name), matrix_world=data[f'{name}_matrix_world'])
+            for name in STROKE_GROUP_NAMES
+        }
+        inputs = BakeInputs(
+            mesh=TriangleMesh(positions=data['mesh_positions'], uvs=data['mesh_uvs']),
+            mesh_matrix_world=data['mesh_matrix_world'],
+            uv_map_name=str(data['uv_map_name']),
+            **groups,
+        )
+        # settings missing from older bundles keep their defaults
+        settings = BakeSettings(**{
+            field.name: data[f'settings_{field.name}'].item()
+            for field in fields(BakeSettings)
+            if f'settings_{field.name}' in data
+        })
+    return inputs, settings
+
+
+def rasterize_shape_pool(
+        pool: Pool,
+        width: int,
+        height: int,
+        shape: list[npt.NDArray[np.float64]],
+        dtype: npt.DTypeLike,
+        center: Optional[npt.NDArray[np.float64]] = None,
+        ) -> ShapeCoverage:
+    shape_center = find_2d_shape_center(shape) if center is None else center
+    shape_max_distance_squared = find_2d_furthest_distance_squared(shape_center, shape)
+
+    pixel_calculator = ShapePixelCalculator(
+        width=width,
+        height=height,
+        shape_center=shape_center,
+        shape_max_distance_squared=shape_max_distance_squared,
+        shape_points=shape,
+    )
+
+    shape_layer = map_pixels(pool, pixel_calculator, width * height, dtype)
+    return ShapeCoverage(x_start=0, y_start=0, values=shape_layer.reshape(height, width))
+
+def bake_shadow_map(
+        inputs: BakeInputs,
+        settings: BakeSettings,
+        write_pixels: Callable[[npt.NDArray[np.float32]], None],
+        channels: int = 1,
+        pool: Optional[Pool] = None,
+        cache: StageCache = stage_cache,
+        disk_cache: Optional[DiskCache] = None,
+        report: Callable[[str], None] = lambda message: None,
+        profiler: Optional[BakeProfiler] = None,
+        progress: Optional[Callable[[float], None]] = None,
+        ) -> BakeProfiler:
+    # write_pixels gets the finished map in blender's pixel layout (bottom row first, channels per pixel);
+    # without a pool every stage runs in this process. returns the profiler holding the stage timings
+    if settings.engine == 'POOL' and pool is None:
+        raise ValueError('The multiprocessing engine needs a worker pool.')
+    if profiler is None:
+        profiler = BakeProfiler()
+    if progress is None:
+        progress = lambda fraction: None
+
+    def step(message: str, fraction: float) -> None:
+        # fraction is the rough share of the bake done once this stage starts
+        progress(fraction)
+        report(message)
+
+    width = settings.width
+    height = settings.height
+    blur_size = settings.blur_size
+    exact_face_lookup = settings.exact_face_lookup
+    dtype = PRECISION_DTYPES[settings.precision]
+
+    mesh = inputs.mesh
+    mesh_matrix_world = inputs.mesh_matrix_world
+
+    def stroke_counts(group: StrokeGroup) -> dict[str, int]:
+        return {'strokes': len(group.strokes), 'points': sum(len(points) for points in group.strokes)}
+
+    profiler.counts.update(
+        faces=len(mesh),
+        width=width,
+        height=height,
+        pixels=width * height,
+        engine=settings.engine,
+        kernels=KERNEL_BACKEND,
+        lines=stroke_counts(inputs.lines),
+        shadow_shapes=stroke_counts(inputs.shadow_shapes),
+        highlight_shapes=stroke_counts(inputs.highlight_shapes),
+    )
+    cache_hits, cache_misses = cache.hits, cache.misses
+
+    # previews measure the tolerance in texels of the full bake, so every pass projects the same strokes
+    uv_tolerance = settings.simplify_tolerance / (settings.simplify_size or max(width, height))
+
+    with profiler.stage('hashing'):
+        mesh_key = content_hash(mesh, mesh_matrix_world)
+
+        def projection_keys(group: StrokeGroup) -> list[str]:
+            return [
+                content_hash('projection', mesh_key, group.matrix_world, points, exact_face_lookup, dtype, uv_tolerance)
+                for points in group.strokes
+            ]
+
+        line_keys = projection_keys(inputs.lines)
+        shadow_shape_keys = projection_keys(inputs.shadow_shapes)
+        highlight_shape_keys = projection_keys(inputs.highlight_shapes)
+
+        # finished maps are stored on disk under the content they were baked from, so identical bakes are skipped
+        shadow_map_key = content_hash(
+            'shadow_map', line_keys, shadow_shape_keys, highlight_shape_keys, inputs.uv_map_name,
+            width, height, blur_size, settings.blur_type, settings.blur_edge, settings.symmetry)
+
+    if disk_cache is not None:
+        with profiler.stage('disk_cache_load') as stage:
+            cached_pixels = disk_cache.load(shadow_map_key)
+            stage.counts['hit'] = cached_pixels is not None
+            if cached_pixels is not None:
+                report('Loaded unchanged shadow map from disk cache.')
+                write_pixels(build_image_buffer(cached_pixels, channels))
+        if cached_pixels is not None:
+            step('Finished!', 1.0)
+            return profiler
+
+    step('Building face lookup...', 0.02)
+    with profiler.stage('face_index', faces=len(mesh)):
+        face_index = cache.get_or_compute(
+            content_hash('face_index', mesh_key),
+            lambda: build_mesh_face_index(mesh, mesh_matrix_world))
+
+    line_strokes = inputs.lines.strokes
+    shadow_shape_strokes = inputs.shadow_shapes.strokes
+    highlight_shape_strokes = inputs.highlight_shapes.strokes
+    # how many drawn points each span of a simplified shape stands for, None while nothing is simplified
+    shadow_shape_weights = None
+    highlight_shape_weights = None
+    if uv_tolerance > 0.0:
+        step('Simplifying strokes...', 0.06)
+        with profiler.stage('stroke_simplification', tolerance=settings.simplify_tolerance) as stage:
+            uv_density = cache.get_or_compute(
+                content_hash('uv_density', mesh_key),
+                lambda: get_uv_density(mesh, mesh_matrix_world))
+
+            def simplify(group: StrokeGroup, keys: list[str]) -> tuple[list, list]:
+                # points are simplified in the group's local space, so the tolerance is scaled down
+                # by the most the group's transform stretches them
+                scale = float(np.linalg.norm(group.matrix_world, 2))
+                tolerance = uv_tolerance * uv_density / scale if scale > 0.0 else 0.0
+                simplified = cache.get_or_compute_many(
+                    [content_hash('simplified', key) for key in keys],
+                    lambda missing: [simplify_stroke(group.strokes[i], tolerance) for i in missing])
+                return [points for points, _ in simplified], [span_weights for _, span_weights in simplified]
+
+            line_strokes, _ = simplify(inputs.lines, line_keys)
+            shadow_shape_strokes, shadow_shape_weights = simplify(inputs.shadow_shapes, shadow_shape_keys)
+            highlight_shape_strokes, highlight_shape_weights = simplify(inputs.highlight_shapes, highlight_shape_keys)
+            stage.counts['points_kept'] = sum(
+                len(points) for points in line_strokes + shadow_shape_strokes + highlight_shape_strokes)
+
+    def create_projector(points_matrix_world: npt.NDArray[np.float64]) -> UVProjector:
+        return UVProjector(
+            triangulated_mesh=mesh,
+            mesh_matrix_world=mesh_matrix_world,
+            points_matrix_world=points_matrix_world,
+            face_index=face_index,
+            exact=exact_face_lookup,
+            dtype=dtype,
+        )
+
+    step('Mapping face strokes to UV coordinates...', 0.1)
+    lines = StrokeGroup(line_strokes, inputs.lines.matrix_world)
+    with profiler.stage('line_projection', **stroke_counts(lines)):
+        uv_projector = create_projector(lines.matrix_world)
+        face_lines_points = lines.strokes
+
+        def project_lines(missing: list[int]) -> list[npt.NDArray[np.floating]]:
+            if pool is None:
+                return [uv_projector(face_lines_points[i]) for i in missing]
+            return map_shared(
+                pool, uv_projector, ['triangulated_mesh', 'face_index'], [face_lines_points[i] for i in missing])
+
+        lines_on_image = cache.get_or_compute_many(line_keys, project_lines)
+
+        # strokes without a point on the mesh are left out
+        line_order = sorted(
+            (i for i in range(len(lines_on_image)) if len(lines_on_image[i]) > 0),
+            key=lambda i: find_average_x_value(lines_on_image[i]))
+        lines_on_image = [lines_on_image[i] for i in line_order]
+
+    step('Finding row intersection points...', 0.25)
+    with profiler.stage('row_intersections', rows=height, lines=len(lines_on_image)):
+        intersections_key = content_hash('intersections', [line_keys[i] for i in line_order], height, dtype)
+        intersection_points = cache.get_or_compute(
+            intersections_key,
+            lambda: find_row_intersections(lines_on_image, height, dtype))
+
+    # moving the lines changes the map, so it happens for every engine and tile setting alike;
+    # without lines the base is flat black, which doesn't mirror
+    mirror_lines = False
+    if settings.symmetry != 'OFF' and lines_on_image:
+        with profiler.stage('symmetry_check', rows=height, lines=len(lines_on_image)) as stage:
+            symmetry_error = get_symmetry_error(intersection_points, width)
+            stage.counts['error'] = symmetry_error
+        if settings.symmetry == 'DETECT' and symmetry_error > SYMMETRY_TOLERANCE:
+            report(f'The vertical lines are up to {symmetry_error:.1f} texels from mirroring each other, '
+                   'baking the full image.')
+        else:
+            mirror_lines = True
+            intersection_points = symmetrize_intersections(intersection_points)
+            intersections_key = content_hash('symmetrized', intersections_key)
+
+    def project_and_close(
+            name: str,
+            group: StrokeGroup,
+            shape_keys: list[str],
+            weights: Optional[list[npt.NDArray[np.float64]]],
+            fraction: float,
+            ) -> tuple[list[str], list, list]:
+        stage_name = name.replace(' ', '_')
+        step(f'Mapping {name} to UV coordinates...', fraction)
+        with profiler.stage(f'{stage_name}_projection', **stroke_counts(group)):
+            projector = create_projector(group.matrix_world)
+            shapes_on_image = cache.get_or_compute_many(
+                shape_keys,
+                lambda missing: [projector(group.strokes[i]) for i in missing])
+            # strokes without a point on the mesh have nothing to close
+            kept = [i for i, shape in enumerate(shapes_on_image) if len(shape) > 0]
+            shapes_on_image = [shapes_on_image[i] for i in kept]
+            shape_keys = [shape_keys[i] for i in kept]
+            if weights is not None:
+                weights = [weights[i] for i in kept]
+
+        step(f'Closing off {name}...', fraction + 0.05)
+        with profiler.stage(f'{stage_name}_closing') as stage:
+            if weights is None:
+                closed_keys = [content_hash('closed', key) for key in shape_keys]
+                closed_shapes = cache.get_or_compute_many(
+                    closed_keys,
+                    lambda missing: [close_2d_shape(shapes_on_image[i]) for i in missing])
+                centers = [None] * len(closed_shapes)
+            else:
+                # simplified shapes keep the center of the drawn ones, their plain mean leans towards the corners
+                closed_keys = [content_hash('closed_weighted', key) for key in shape_keys]
+                closed = cache.get_or_compute_many(
+                    closed_keys,
+                    lambda missing: [close_weighted_2d_shape(shapes_on_image[i], weights[i]) for i in missing])
+                closed_shapes = [shape for shape, _ in closed]
+                centers = [center for _, center in closed]
+            stage.counts['points_kept'] = [len(shape) for shape in closed_shapes]
+        return closed_keys, closed_shapes, centers
+
+    shadow_shape_keys, shadow_shapes_on_image, shadow_centers = project_and_close(
+        'shadow shapes', StrokeGroup(shadow_shape_strokes, inputs.shadow_shapes.matrix_world),
+        shadow_shape_keys, shadow_shape_weights, 0.3)
+    highlight_shape_keys, highlight_shapes_on_image, highlight_centers = project_and_close(
+        'highlight shapes', StrokeGroup(highlight_shape_strokes, inputs.highlight_shapes.matrix_world),
+        highlight_shape_keys, highlight_shape_weights, 0.4)
+
+    if settings.engine == 'NUMPY' and settings.use_tiles:
+        # every stage runs per tile and lands in files on disk, which are handed over directly
+        step('Rendering tiles...', 0.5)
+        with tempfile.TemporaryDirectory() as directory:
+            with profiler.stage('tiled_render', pixels=width * height, tile_size=settings.tile_size):
+                output_buffer = render_tiled(
+                    width=width,
+                    height=height,
+                    intersection_points=intersection_points,
+                    shadow_shapes=shadow_shapes_on_image,
+                    highlight_shapes=highlight_shapes_on_image,
+                    blur_size=blur_size,
+                    blur_type=settings.blur_type,
+                    blur_edge=settings.blur_edge,
+                    channels=channels,
+                    directory=directory,
+                    tile_size=settings.tile_size,
+                    dtype=dtype,
+                    progress=lambda fraction: progress(0.5 + 0.45 * fraction),
+                    shadow_centers=shadow_centers,
+                    highlight_centers=highlight_centers,
+                )
+            step('Updating image...', 0.95)
+            with profiler.stage('write_back', pixels=width * height, channels=channels):
+                write_pixels(output_buffer)
+            if disk_cache is not None:
+                with profiler.stage('disk_cache_save'):
+                    # the strided view is written out in chunks, the memmap is never loaded as a whole
+                    disk_cache.save(shadow_map_key, output_buffer[::channels])
+            # the file can't be removed while it is still mapped on windows
+            del output_buffer
+        profiler.counts.update(cache_hits=cache.hits - cache_hits, cache_misses=cache.misses - cache_misses)
+        step('Finished!', 1.0)
+        return profiler
+
+    def shape_coverages(
+            shape_keys: list[str],
+            shapes: list[list[npt.NDArray[np.floating]]],
+            centers: list[Optional[npt.NDArray[np.float64]]],
+            ) -> list[ShapeCoverage]:
+        def rasterize(shape: list[npt.NDArray[np.floating]], center: Optional[npt.NDArray[np.float64]]) -> ShapeCoverage:
+            if settings.engine == 'NUMPY':
+                return rasterize_shape(width, height, shape, dtype, center=center)
+            return rasterize_shape_pool(pool, width, height, shape, dtype, center)
+        return cache.get_or_compute_many(
+            [content_hash('coverage', key, width, height, settings.engine) for key in shape_keys],
+            lambda missing: [rasterize(shapes[i], centers[i]) for i in missing])
+
+    def rasterize_shapes(name: str, shape_keys: list[str], shapes: list, centers: list) -> list[ShapeCoverage]:
+        with profiler.stage(f'{name}_rasterization', shapes=len(shapes)) as stage:
+            coverages = shape_coverages(shape_keys, shapes, centers)
+            stage.counts['pixels_touched'] = [
+                int(np.count_nonzero(~np.isnan(coverage.values))) for coverage in coverages]
+        return coverages
+
+    step('Calculating shadow pixels...', 0.5)
+    shadow_coverages = rasterize_shapes('shadow_shapes', shadow_shape_keys, shadow_shapes_on_image, shadow_centers)
+
+    step('Calculating highlight pixels...', 0.6)
+    highlight_coverages = rasterize_shapes(
+        'highlight_shapes', highlight_shape_keys, highlight_shapes_on_image, highlight_centers)
+
+    image_pixels = None
+    if settings.engine == 'NUMPY' and mirror_lines:
+        coverages = shadow_coverages + highlight_coverages
+        mirrored_pixels = count_symmetric_pixels(
+            width, height, blur_size, settings.blur_type, [bounds for bounds, _ in find_shape_regions(coverages)])
+        if mirrored_pixels > MAX_MIRRORED_SHARE * width * height:
+            report('The shapes cover too much of the image to save time by mirroring, baking the full image.')
+        else:
+            step('Rendering one half and mirroring it...', 0.7)
+            with profiler.stage('symmetric_render', pixels=width * height, pixels_computed=mirrored_pixels):
+                image_pixels = render_symmetric(
+                    width=width,
+                    height=height,
+                    intersection_points=intersection_points,
+                    coverages=coverages,
+                    remaps=[remap_shadow_value] * len(shadow_coverages) + [remap_highlight_value] * len(highlight_coverages),
+                    blur_size=blur_size,
+                    blur_type=settings.blur_type,
+                    blur_edge=settings.blur_edge,
+                    dtype=dtype,
+                ).reshape(width * height)
+
+    if image_pixels is None:
+        step('Calculating base pixels...', 0.7)
+
+        def calculate_base() -> npt.NDArray[np.floating]:
+            if settings.engine == 'NUMPY':
+                return calculate_base_pixels(width, height, intersection_points, dtype)
+            base_pixel_calculator = BasePixelCalculator(width, height, intersection_points)
+            return map_pixels(pool, base_pixel_calculator, width * height, dtype)
+
+        with profiler.stage('base_pixels', pixels=width * height):
+            # the cached base is shared, so blending happens on a copy
+            image_pixels = cache.get_or_compute(
+                content_hash('base', intersections_key, width, settings.engine),
+                calculate_base).copy()
+
+        whole_image = Tile(0, 0, width, height)
+        step('Blending shapes...', 0.8)
+        with profiler.stage('shadow_shapes_blending', shapes=len(shadow_coverages)):
+            blend_coverages(image_pixels, shadow_coverages, remap_shadow_value, whole_image)
+        with profiler.stage('highlight_shapes_blending', shapes=len(highlight_coverages)):
+            blend_coverages(image_pixels, highlight_coverages, remap_highlight_value, whole_image)
+
+        step('Blurring final result...', 0.9)
+        with profiler.stage('blur', pixels=width * height, size=blur_size):
+            image_pixels_2d = blur_image(image_pixels.reshape((height, width)), blur_size, settings.blur_type, settings.blur_edge)
+            image_pixels = image_pixels_2d.reshape(width * height)
+
+    step('Updating image...', 0.95)
+    with profiler.stage('write_back', pixels=width * height, channels=channels):
+        write_pixels(build_image_buffer(image_pixels, channels))
+    if disk_cache is not None:
+        with profiler.stage('disk_cache_save'):
+            disk_cache.save(shadow_map_key, image_pixels.astype(np.float32, copy=False))
+
+    profiler.counts.update(cache_hits=cache.hits - cache_hits, cache_misses=cache.misses - cache_misses)
+    step('Finished!', 1.0)
+    return profiler
+
+
+def get_preview_scales(preview_scale: float, refine: bool) -> list[float]:
+    # the preview scale, then doubling up to full resolution when refining
+    scales = [min(preview_scale, 1.0)]
+    while refine and scales[-1] < 1.0:
+        scales.append(min(scales[-1] * 2.0, 1.0))
+    return scales
+
+def scale_settings(settings: BakeSettings, scale: float) -> BakeSettings:
+    # previews are small enough to never need tiles
+    return replace(
+        settings,
+        width=max(round(settings.width * scale), 1),
+        height=max(round(settings.height * scale), 1),
+        blur_size=max(round(settings.blur_size * scale), 1),
+        use_tiles=settings.use_tiles and scale >= 1.0,
+        simplify_size=settings.simplify_size or max(settings.width, settings.height),
+    )
+
+def bake_progressive(
+        inputs: BakeInputs,
+        settings: BakeSettings,
+        write_pixels: Callable[[npt.NDArray[np.float32]], None],
+        scales: list[float],
+        channels: int = 1,
+        pool: Optional[Pool] = None,
+        cache: StageCache = stage_cache,
+        disk_cache: Optional[DiskCache] = None,
+        report: Callable[[str], None] = lambda message: None,
+        profiler: Optional[BakeProfiler] = None,
+        progress: Optional[Callable[[float], None]] = None,
+        ) -> BakeProfiler:
+    # bakes once per scale and writes every pass upsampled to the full size; projections, the face
+    # lookup and closed shapes don't depend on the resolution, so later passes take them from the cache
+    if profiler is None:
+        profiler = BakeProfiler()
+    if progress is None:
+        progress = lambda fraction: None
+
+    # passes take about as long as their pixel count
+    weights = np.array([scale ** 2 for scale in scales])
+    starts = np.concatenate([[0.0], np.cumsum(weights)[:-1]]) / weights.sum()
+    shares = weights / weights.sum()
+
+    for scale, start, share in zip(scales, starts, shares):
+        pass_progress = lambda fraction, start=start, share=share: progress(start + share * fraction)
+        if scale >= 1.0:
+            bake_shadow_map(
+                inputs, settings, write_pixels,
+                channels=channels, pool=pool, cache=cache, disk_cache=disk_cache,
+                report=report, profiler=profiler, progress=pass_progress)
+            continue
+
+        preview_settings = scale_settings(settings, scale)
+
+        def write_preview(pixel_buffer: npt.NDArray[np.float32], preview_settings: BakeSettings = preview_settings) -> None:
+            preview = pixel_buffer.reshape(preview_settings.height, preview_settings.width)
+            write_pixels(build_image_buffer(resize_bilinear(preview, settings.width, settings.height).reshape(-1), channels))
+
+        label = f'Preview at {round(scale * 100)}%'
+        bake_shadow_map(
+            inputs, preview_settings, write_preview,
+            channels=1, pool=pool, cache=cache,
+            report=lambda message, label=label: report(f'{label}: {message}'),
+            profiler=profiler, progress=pass_progress)
+    return profiler
+
+
+def find_unique_frames(frames: dict[int, BakeInputs]) -> dict[int, list[int]]:
+    # groups frames whose strokes are identical under the first of them, each group only needs one bake
+    groups: dict[str, list[int]] = {}
+    for frame in sorted(frames):
+        inputs = frames[frame]
+        groups.setdefault(content_hash(inputs.lines, inputs.shadow_shapes, inputs.highlight_shapes), []).append(frame)
+    return {same_frames[0]: same_frames for same_frames in groups.values()}
+
+def get_atlas_cells(count: int, width: int, height: int) -> list[Tile]:
+    # the most square grid of count equal cells, filled left to right from the top
+    # (rows are in blender's bottom first order); pixels left over by the division stay empty
+    columns = int(np.ceil(np.sqrt(count)))
+    rows = int(np.ceil(count / columns))
+    cell_width = width // columns
+    cell_height = height // rows
+    cells = []
+    for index in range(count):
+        column, row = index % columns, index // columns
+        y_stop = height - row * cell_height
+        cells.append(Tile(column * cell_width, y_stop - cell_height, (column + 1) * cell_width, y_stop))
+    return cells
+
+def cell_settings(settings: BakeSettings, cell: Tile) -> BakeSettings:
+    # the blur shrinks with the cell, so every cell looks like a full size bake scaled down
+    return replace(
+        settings,
+        width=cell.width,
+        height=cell.height,
+        blur_size=max(round(settings.blur_size * cell.width / settings.width), 1),
+    )
+
+
+@dataclass
+class BakeTask:
+    # one whole bake to run inside a pool worker, for baking many targets at once
+    name: str
+    inputs: BakeInputs
+    settings: BakeSettings
+    disk_cache: Optional[DiskCache]
+    use_cache: bool
+    profiler: BakeProfiler
+
+# every pool worker keeps its own stage cache, together they hold as much as the one in blender's process
+worker_stage_cache = StageCache(max_bytes=DEFAULT_MAX_BYTES // get_worker_count())
+
+def run_bake_task(task: BakeTask) -> tuple[str, Optional[npt.NDArray[np.float32]], BakeProfiler, Optional[str]]:
+    # returns the task name, the gray pixels (or None and an error message) and the filled in profiler;
+    # the task already runs in a worker, so its stages run in that same process
+    result = []
+
+    def keep_pixels(pixel_buffer: npt.NDArray[np.float32]) -> None:
+        # tiled buffers are only valid during the call
+        result.append(np.array(pixel_buffer, dtype=np.float32))
+
+    try:
+        bake_shadow_map(
+            task.inputs,
+            replace(task.settings, engine='NUMPY'),
+            write_pixels=keep_pixels,
+            cache=worker_stage_cache if task.use_cache else StageCache(max_bytes=0),
+            disk_cache=task.disk_cache,
+            report=lambda message: None,
+            profiler=task.profiler,
+        )
+    except Exception as e:
+        return task.name, None, task.profiler, f'{type(e).__name__}: {e}'
+    return task.name, result[-1], task.profiler, None
+
+def run_bake_tasks(tasks: list[BakeTask]) -> list[tuple[str, Optional[npt.NDArray[np.float32]], BakeProfiler, Optional[str]]]:
+    # a run of tasks in one worker, later ones reuse what the earlier ones left in its stage cache
+    return [run_bake_task(task) for task in tasks]
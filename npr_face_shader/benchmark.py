@@ -0,0 +1,224 @@
+from typing import Any, Callable, Optional
+from dataclasses import asdict
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+from .utils import *
+from .blur import blur_image
+from .bake import BakeInputs
+from .synthetic import SyntheticFace, build_synthetic_inputs
+
+# usage: python -m npr_face_shader.benchmark [--compare benchmarks/baseline.json] [--save benchmarks/baseline.json]
+
+DEFAULT_RESOLUTIONS = [256, 512, 1024, 2048, 4096]
+DEFAULT_BASELINE_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'benchmarks', 'baseline.json')
+
+# a stage counts as regressed once it is this much slower than its baseline
+DEFAULT_THRESHOLD = 0.25
+# differences below this many seconds are timer noise, not regressions
+NOISE_FLOOR = 0.005
+
+BENCHMARK_BLUR_SIZE = 25
+
+STAGES = [
+    'face_index',
+    'projection',
+    'shape_closing',
+    'row_intersections',
+    'base_pixels',
+    'shape_rasterization',
+    'blending',
+    'blur',
+    'write_back',
+]
+
+
+def run_stages(inputs: BakeInputs, size: int, dtype: npt.DTypeLike = np.float64) -> dict[str, float]:
+    # runs the vectorized pipeline on a size x size image, returns seconds per stage
+    timings = {}
+
+    def timed(stage: str, function: Callable[[], Any]) -> Any:
+        start = time.perf_counter()
+        result = function()
+        timings[stage] = time.perf_counter() - start
+        return result
+
+    face_index = timed('face_index', lambda: build_mesh_face_index(inputs.mesh, inputs.mesh_matrix_world))
+
+    def project(strokes: list[npt.NDArray[np.float32]], matrix_world: npt.NDArray[np.float64]) -> list:
+        return [
+            project_points_to_uv(inputs.mesh, inputs.mesh_matrix_world, points, matrix_world, face_index, dtype=dtype)
+            for points in strokes
+        ]
+
+    lines, shadow_shapes, highlight_shapes = timed('projection', lambda: (
+        project(inputs.lines.strokes, inputs.lines.matrix_world),
+        project(inputs.shadow_shapes.strokes, inputs.shadow_shapes.matrix_world),
+        project(inputs.highlight_shapes.strokes, inputs.highlight_shapes.matrix_world),
+    ))
+    shadow_shapes, highlight_shapes = timed('shape_closing', lambda: (
+        [close_2d_shape(shape) for shape in shadow_shapes],
+        [close_2d_shape(shape) for shape in highlight_shapes],
+    ))
+    lines.sort(key=find_average_x_value)
+
+    intersection_points = timed('row_intersections', lambda: find_row_intersections(lines, size, dtype))
+    image_pixels = timed('base_pixels', lambda: calculate_base_pixels(size, size, intersection_points, dtype))
+
+    coverages = timed('shape_rasterization', lambda: (
+        [rasterize_shape(size, size, shape, dtype) for shape in shadow_shapes],
+        [rasterize_shape(size, size, shape, dtype) for shape in highlight_shapes],
+    ))
+
+    whole_image = Tile(0, 0, size, size)
+
+    def blend_all() -> None:
+        blend_coverages(image_pixels, coverages[0], remap_shadow_value, whole_image)
+        blend_coverages(image_pixels, coverages[1], remap_highlight_value, whole_image)
+
+    timed('blending', blend_all)
+    blurred = timed('blur', lambda: blur_image(image_pixels.reshape(size, size), BENCHMARK_BLUR_SIZE))
+    # everything up to the foreach_set call, which needs blender
+    timed('write_back', lambda: build_image_buffer(blurred.reshape(-1), 4))
+    return timings
+
+def run_benchmark(
+        face: SyntheticFace,
+        resolutions: list[int],
+        repeats: int = 3,
+        dtype: npt.DTypeLike = np.float64,
+        report: Callable[[str], None] = lambda message: None,
+        ) -> dict[str, dict[str, float]]:
+    # fastest of the repeats per stage, the other runs are disturbed by something else
+    inputs = build_synthetic_inputs(face)
+    results = {}
+    for size in resolutions:
+        best = {}
+        for _ in range(repeats):
+            for stage, seconds in run_stages(inputs, size, dtype).items():
+                best[stage] = min(best.get(stage, seconds), seconds)
+        results[str(size)] = best
+        report(format_timings(size, best))
+    return results
+
+def format_timings(size: int, timings: dict[str, float]) -> str:
+    columns = ', '.join(f'{stage} {timings[stage] * 1000.0:.1f}ms' for stage in STAGES)
+    return f'{size}x{size}: {columns}, total {sum(timings.values()) * 1000.0:.1f}ms'
+
+def get_machine_info() -> dict[str, Any]:
+    return {
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'kernels': KERNEL_BACKEND,
+    }
+
+def build_baseline(
+        face: SyntheticFace,
+        precision: str,
+        results: dict[str, dict[str, float]],
+        threshold: float,
+        ) -> dict[str, Any]:
+    return {
+        'machine': get_machine_info(),
+        'face': asdict(face),
+        'precision': precision,
+        'threshold': threshold,
+        'results': results,
+    }
+
+def find_regressions(
+        results: dict[str, dict[str, float]],
+        baseline: dict[str, Any],
+        threshold: Optional[float] = None,
+        ) -> list[tuple[str, str, float, float]]:
+    # (resolution, stage, baseline seconds, current seconds) for every stage that got slower than allowed
+    if threshold is None:
+        threshold = baseline.get('threshold', DEFAULT_THRESHOLD)
+    regressions = []
+    for size, timings in results.items():
+        for stage, seconds in timings.items():
+            baseline_seconds = baseline['results'].get(size, {}).get(stage)
+            if baseline_seconds is None:
+                continue
+            if seconds > baseline_seconds * (1.0 + threshold) and seconds - baseline_seconds > NOISE_FLOOR:
+                regressions.append((size, stage, baseline_seconds, seconds))
+    return regressions
+
+
+def parse_arguments(argv: Optional[list[str]]) -> argparse.Namespace:
+    defaults = SyntheticFace()
+    parser = argparse.ArgumentParser(
+        prog='python -m npr_face_shader.benchmark',
+        description='Time every stage of the shadow map pipeline on generated faces.',
+    )
+    parser.add_argument('-r', '--resolutions', type=int, nargs='+', default=DEFAULT_RESOLUTIONS)
+    parser.add_argument('-n', '--repeats', type=int, default=3, help='runs per resolution, the fastest is kept')
+    parser.add_argument('--precision', choices=list(PRECISION_DTYPES), default='DOUBLE')
+    parser.add_argument('--mesh-resolution', type=int, default=defaults.mesh_resolution,
+                        help='grid cells per side of the face mesh')
+    parser.add_argument('--lines', type=int, default=defaults.line_count, help='vertical lines')
+    parser.add_argument('--shadows', type=int, default=defaults.shadow_count, help='shadow shapes')
+    parser.add_argument('--highlights', type=int, default=defaults.highlight_count, help='highlight shapes')
+    parser.add_argument('--stroke-points', type=int, default=defaults.line_points, help='points per stroke')
+    parser.add_argument('--seed', type=int, default=defaults.seed)
+    parser.add_argument('--save', metavar='FILE', help='write the results as a new baseline')
+    parser.add_argument('--compare', metavar='FILE', nargs='?', const=DEFAULT_BASELINE_FILE,
+                        help=f'fail if a stage got slower than its baseline (default file: {DEFAULT_BASELINE_FILE})')
+    parser.add_argument('--threshold', type=float,
+                        help=f'allowed slowdown as a fraction, defaults to the one in the baseline or {DEFAULT_THRESHOLD}')
+    return parser.parse_args(argv)
+
+def main(argv: Optional[list[str]] = None) -> int:
+    arguments = parse_arguments(argv)
+    face = SyntheticFace(
+        mesh_resolution=arguments.mesh_resolution,
+        line_count=arguments.lines,
+        line_points=arguments.stroke_points,
+        shadow_count=arguments.shadows,
+        highlight_count=arguments.highlights,
+        shape_points=arguments.stroke_points,
+        seed=arguments.seed,
+    )
+
+    baseline = None
+    if arguments.compare is not None:
+        with open(arguments.compare, 'r') as f:
+            baseline = json.load(f)
+        if baseline['face'] != asdict(face) or baseline['precision'] != arguments.precision:
+            print('The baseline was measured on a different synthetic face or precision, '
+                  'pass the same options it was saved with.', file=sys.stderr)
+            return 2
+        if baseline['machine'] != get_machine_info():
+            print('Warning: the baseline was measured on a different machine or setup.', file=sys.stderr)
+
+    results = run_benchmark(
+        face, arguments.resolutions, arguments.repeats, PRECISION_DTYPES[arguments.precision], report=print)
+
+    if arguments.save is not None:
+        threshold = arguments.threshold if arguments.threshold is not None else DEFAULT_THRESHOLD
+        os.makedirs(os.path.dirname(os.path.abspath(arguments.save)), exist_ok=True)
+        with open(arguments.save, 'w') as f:
+            json.dump(build_baseline(face, arguments.precision, results, threshold), f, indent=2)
+            f.write('\n')
+        print(f'Saved baseline to {arguments.save}.')
+
+    if baseline is not None:
+        regressions = find_regressions(results, baseline, arguments.threshold)
+        for size, stage, baseline_seconds, seconds in regressions:
+            print(f'Regression at {size}x{size}: {stage} took {seconds * 1000.0:.1f}ms, '
+                  f'baseline {baseline_seconds * 1000.0:.1f}ms', file=sys.stderr)
+        if regressions:
+            return 1
+        print('No regressions against the baseline.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+from typing import Callable
+
+import numpy as np
+import numpy.typing as npt
+
+from .utils import build_gaussian_kernel
+
+# edge mode names used by FaceShadeProps mapped to np.pad modes
+EDGE_PAD_MODES = {
+    'ZERO': 'constant',
+    'EXTEND': 'edge',
+    'REFLECT': 'symmetric',
+}
+
+# box passes used to approximate a gaussian
+ITERATED_BOX_PASSES = 3
+
+# lines blurred together, bounds the float64 temporaries of a pass
+BLUR_STRIP_SIZE = 256
+
+
+def pad_axis(image: npt.NDArray, before: int, after: int, axis: int, edge_mode: str) -> npt.NDArray:
+    padding = [(0, 0)] * image.ndim
+    padding[axis] = (before, after)
+    return np.pad(image, padding, mode=EDGE_PAD_MODES[edge_mode])
+
+def map_strips(image: npt.NDArray, axis: int, blur_strip: Callable[[npt.NDArray], npt.NDArray]) -> npt.NDArray:
+    # runs blur_strip over bands of lines along axis, the result keeps the dtype of image
+    output = np.empty_like(image)
+    other_axis = 1 - axis
+    for start in range(0, image.shape[other_axis], BLUR_STRIP_SIZE):
+        strip = [slice(None), slice(None)]
+        strip[other_axis] = slice(start, start + BLUR_STRIP_SIZE)
+        output[tuple(strip)] = blur_strip(image[tuple(strip)])
+    return output
+
+def box_blur_axis(image: npt.NDArray, size: int, axis: int, edge_mode: str = 'ZERO') -> npt.NDArray:
+    return map_strips(image, axis, lambda strip: box_blur_strip(strip, size, axis, edge_mode))
+
+def box_blur_strip(image: npt.NDArray, size: int, axis: int, edge_mode: str) -> npt.NDArray[np.float64]:
+    # running sum, so the cost does not depend on size;
+    # the window is aligned like np.convolve(..., mode='same')
+    # the sums always accumulate in float64, whatever the image dtype
+    padded = pad_axis(image.astype(np.float64), size // 2, (size - 1) // 2, axis, edge_mode)
+    sums = np.cumsum(padded, axis=axis)
+    sums = np.concatenate([np.zeros_like(np.take(sums, [0], axis=axis)), sums], axis=axis)
+    length = sums.shape[axis]
+    upper = np.take(sums, np.arange(size, length), axis=axis)
+    lower = np.take(sums, np.arange(0, length - size), axis=axis)
+    return (upper - lower) / size
+
+def convolve_axis(image: npt.NDArray, kernel: npt.NDArray, axis: int, edge_mode: str = 'ZERO') -> npt.NDArray:
+    return map_strips(image, axis, lambda strip: convolve_strip(strip, kernel, axis, edge_mode))
+
+def convolve_strip(image: npt.NDArray, kernel: npt.NDArray, axis: int, edge_mode: str) -> npt.NDArray[np.float64]:
+    # fft convolution, so large kernels cost about the same as small ones
+    size = len(kernel)
+    padded = pad_axis(image.astype(np.float64), size // 2, (size - 1) // 2, axis, edge_mode)
+    length = padded.shape[axis]
+    fft_length = 1 << int(np.ceil(np.log2(length + size - 1)))
+    kernel_shape = [1] * image.ndim
+    kernel_shape[axis] = size
+    spectrum = np.fft.rfft(padded, n=fft_length, axis=axis) * \
+        np.fft.rfft(kernel.reshape(kernel_shape), n=fft_length, axis=axis)
+    full = np.fft.irfft(spectrum, n=fft_length, axis=axis)
+    # keep only the fully overlapping part, which lines up with the unpadded image
+    return np.take(full, np.arange(size - 1, length), axis=axis)
+
+def iterated_box_sizes(sigma: float, passes: int = ITERATED_BOX_PASSES) -> list[int]:
+    # odd box widths whose repeated application has the given standard deviation (Kovesi 2010)
+    ideal_width = np.sqrt(12.0 * sigma ** 2 / passes + 1.0)
+    lower_width = int(np.floor(ideal_width))
+    if lower_width % 2 == 0:
+        lower_width -= 1
+    lower_width = max(lower_width, 1)
+    upper_width = lower_width + 2
+    lower_count = round((12.0 * sigma ** 2 - passes * lower_width ** 2 - 4 * passes * lower_width - 3 * passes) /
+                        (-4.0 * lower_width - 4.0))
+    return [lower_width if i < lower_count else upper_width for i in range(passes)]
+
+def get_blur_reach(size: int, blur_type: str = 'BOX') -> int:
+    # furthest distance in pixels along either axis that a blurred pixel takes values from
+    if size <= 1:
+        return 0
+    if blur_type == 'ITERATED_BOX':
+        return sum(box_size // 2 for box_size in iterated_box_sizes(size / 6.0))
+    return size // 2
+
+def blur_image(
+        image_2d: npt.NDArray,
+        size: int,
+        blur_type: str = 'BOX',
+        edge_mode: str = 'ZERO',
+        ) -> npt.NDArray:
+    # separable blur over both axes, intermediate images keep the dtype of the input
+    if size <= 1:
+        return image_2d.copy()
+
+    blurred = image_2d
+    for axis in (0, 1):
+        if blur_type == 'BOX':
+            blurred = box_blur_axis(blurred, size, axis, edge_mode)
+        elif blur_type == 'ITERATED_BOX':
+            # same standard deviation as the gaussian kernel below
+            for box_size in iterated_box_sizes(size / 6.0):
+                blurred = box_blur_axis(blurred, box_size, axis, edge_mode)
+        elif blur_type == 'GAUSSIAN':
+            blurred = convolve_axis(blurred, build_gaussian_kernel(size), axis, edge_mode)
+        else:
+            raise ValueError(f'Unknown blur type: {blur_type}')
+
+    return blurred
@@ -0,0 +1,108 @@
+from typing import Any, Callable, Optional, TypeVar
+from collections import OrderedDict
+from dataclasses import fields, is_dataclass
+import hashlib
+
+import numpy as np
+
+# memory the stage cache may hold before evicting the least recently used entries
+DEFAULT_MAX_BYTES = 1 << 30
+
+T = TypeVar('T')
+
+
+def update_hash(digest: Any, part: Any) -> None:
+    if isinstance(part, np.ndarray):
+        digest.update(f'ndarray:{part.dtype.str}:{part.shape}'.encode())
+        digest.update(np.ascontiguousarray(part).data)
+    elif isinstance(part, (list, tuple)):
+        digest.update(f'{type(part).__name__}:{len(part)}'.encode())
+        for item in part:
+            update_hash(digest, item)
+    elif is_dataclass(part):
+        digest.update(type(part).__name__.encode())
+        for field in fields(part):
+            update_hash(digest, getattr(part, field.name))
+    else:
+        digest.update(f'{type(part).__name__}:{part!r}'.encode())
+
+def content_hash(*parts: Any) -> str:
+    # stable across runs, so keys can also be used on disk
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        update_hash(digest, part)
+    return digest.hexdigest()
+
+def estimate_size(value: Any) -> int:
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_size(item) for item in value) + 8 * len(value)
+    if is_dataclass(value):
+        return sum(estimate_size(getattr(value, field.name)) for field in fields(value))
+    return 64
+
+
+class StageCache:
+    # least recently used cache of intermediate results, keyed by content_hash values;
+    # cached values are shared, so callers must copy before modifying them
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[str, tuple[Any, int]] = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: str, value: Any) -> None:
+        size = estimate_size(value)
+        if key in self.entries:
+            self.total_bytes -= self.entries.pop(key)[1]
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (value, size)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.total_bytes -= evicted_size
+
+    def get_or_compute(self, key: str, compute: Callable[[], T]) -> T:
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def get_or_compute_many(self, keys: list[str], compute_missing: Callable[[list[int]], list[T]]) -> list[T]:
+        # compute_missing gets the indices of the keys that are not cached and
+        # returns their values in the same order, so they can be computed as one batch
+        values = [self.get(key) for key in keys]
+        missing = [i for i, value in enumerate(values) if value is None]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            for i, value in zip(missing, compute_missing(missing)):
+                self.put(keys[i], value)
+                values[i] = value
+        return values
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.total_bytes = 0
+
+
+# kept between operator runs so unchanged stages are reused
+stage_cache = StageCache()
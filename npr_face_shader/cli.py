@@ -0,0 +1,149 @@
+from typing import Optional
+from dataclasses import dataclass, replace
+from multiprocessing.pool import Pool
+import argparse
+import os
+import struct
+import sys
+import time
+import zlib
+
+import numpy as np
+import numpy.typing as npt
+
+from .bake import bake_shadow_map, load_bundle
+from .cache import StageCache
+from .disk_cache import DiskCache, DEFAULT_DISK_CACHE_SIZE_MB
+from .workers import get_worker_count
+
+# usage: python -m npr_face_shader.cli bundle.npz [bundle.npz ...] --output-dir maps
+
+OUTPUT_FORMATS = ['png', 'npy']
+
+# rows compressed per write while saving pngs
+PNG_ROWS_PER_CHUNK = 64
+
+
+def write_png(path: str, pixels: npt.NDArray[np.floating]) -> None:
+    # 16 bit grayscale png, rows are written top first; pixels is (height, width) with the bottom row first
+    height, width = pixels.shape
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    compressor = zlib.compressobj()
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 16, 0, 0, 0, 0)))
+        for stop in range(height, 0, -PNG_ROWS_PER_CHUNK):
+            rows = np.asarray(pixels[max(stop - PNG_ROWS_PER_CHUNK, 0):stop])[::-1]
+            values = np.round(np.clip(rows, 0.0, 1.0) * 65535.0).astype('>u2')
+            # every row starts with filter type 0
+            scanlines = np.concatenate([np.zeros((len(values), 1), dtype=np.uint8), values.view(np.uint8)], axis=1)
+            f.write(chunk(b'IDAT', compressor.compress(scanlines.tobytes())))
+        f.write(chunk(b'IDAT', compressor.flush()))
+        f.write(chunk(b'IEND', b''))
+
+def write_shadow_map(path: str, pixels: npt.NDArray[np.floating]) -> None:
+    if path.endswith('.npy'):
+        # top row first, like the png
+        np.save(path, np.asarray(pixels)[::-1])
+    else:
+        write_png(path, pixels)
+
+
+@dataclass
+class BundleJob:
+    bundle_path: str
+    output_path: str
+    cache_directory: Optional[str]
+    cache_size: int
+    verbose: bool
+    log_path: Optional[str] = None
+
+
+def bake_bundle(job: BundleJob) -> tuple[str, Optional[str], float]:
+    # returns the bundle path, an error message if the bake failed and the time it took
+    start = time.perf_counter()
+    try:
+        inputs, settings = load_bundle(job.bundle_path)
+        # bundles already run in parallel, so each one is baked inside its own process
+        settings = replace(settings, engine='NUMPY')
+        disk_cache = DiskCache(job.cache_directory, job.cache_size << 20) \
+            if job.cache_directory is not None else None
+        name = os.path.basename(job.bundle_path)
+        profiler = bake_shadow_map(
+            inputs,
+            settings,
+            write_pixels=lambda pixel_buffer: write_shadow_map(
+                job.output_path, pixel_buffer.reshape(settings.height, settings.width)),
+            # workers are reused for other bundles, which share none of this bundle's stages
+            cache=StageCache(max_bytes=0),
+            disk_cache=disk_cache,
+            report=(lambda message: print(f'{name}: {message}', flush=True)) if job.verbose else (lambda message: None),
+        )
+        if job.log_path is not None:
+            profiler.counts['bundle'] = job.bundle_path
+            profiler.write(job.log_path)
+    except Exception as e:
+        return job.bundle_path, f'{type(e).__name__}: {e}', time.perf_counter() - start
+    return job.bundle_path, None, time.perf_counter() - start
+
+def get_output_path(bundle_path: str, output_directory: Optional[str], output_format: str) -> str:
+    directory = output_directory or os.path.dirname(bundle_path)
+    name = os.path.splitext(os.path.basename(bundle_path))[0]
+    return os.path.join(directory, f'{name}.{output_format}')
+
+def parse_arguments(argv: Optional[list[str]]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='python -m npr_face_shader.cli',
+        description='Bake face shadow maps from bundles exported with "Export Bake Bundle", without Blender.',
+    )
+    parser.add_argument('bundles', nargs='+', help='.npz bake bundles')
+    parser.add_argument('-o', '--output-dir', help='where to write the maps (default: next to each bundle)')
+    parser.add_argument('-f', '--format', choices=OUTPUT_FORMATS, default='png',
+                        help='png (16 bit grayscale, clipped to 0-1) or npy (float32 array)')
+    parser.add_argument('-j', '--jobs', type=int, default=get_worker_count(),
+                        help='bundles baked at the same time (default: one per core)')
+    parser.add_argument('--cache-dir', help='reuse and store finished maps in this disk cache')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_DISK_CACHE_SIZE_MB,
+                        help='disk cache size in MB')
+    parser.add_argument('--log', metavar='FILE', help='append the stage timings of every bake to this file as json lines')
+    parser.add_argument('-v', '--verbose', action='store_true', help='print the progress of every bake')
+    return parser.parse_args(argv)
+
+def main(argv: Optional[list[str]] = None) -> int:
+    arguments = parse_arguments(argv)
+    if arguments.output_dir is not None:
+        os.makedirs(arguments.output_dir, exist_ok=True)
+
+    jobs = [
+        BundleJob(
+            bundle_path=bundle_path,
+            output_path=get_output_path(bundle_path, arguments.output_dir, arguments.format),
+            cache_directory=arguments.cache_dir,
+            cache_size=arguments.cache_size,
+            verbose=arguments.verbose,
+            log_path=arguments.log,
+        )
+        for bundle_path in arguments.bundles
+    ]
+
+    job_count = max(min(arguments.jobs, len(jobs)), 1)
+    failures = 0
+    with Pool(processes=job_count) as pool:
+        # one bundle per task, so a large bake doesn't hold up a queue of small ones
+        results = pool.imap_unordered(bake_bundle, jobs, chunksize=1)
+        for bundle_path, error, duration in results:
+            if error is None:
+                print(f'{bundle_path}: done in {duration:.1f}s', flush=True)
+            else:
+                failures += 1
+                print(f'{bundle_path}: failed after {duration:.1f}s ({error})', file=sys.stderr, flush=True)
+
+    print(f'{len(jobs) - failures} of {len(jobs)} bundles baked.')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+from typing import Optional
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+import numpy.typing as npt
+
+DEFAULT_DISK_CACHE_DIRECTORY = os.path.join(tempfile.gettempdir(), 'npr_face_shader_cache')
+DEFAULT_DISK_CACHE_SIZE_MB = 2048
+
+CACHE_FILE_EXTENSION = '.npz'
+
+
+class DiskCache:
+    # content addressed store of baked shadow maps, one compressed file per key;
+    # least recently used files are removed once the directory grows past max_bytes
+
+    def __init__(self, directory: str = DEFAULT_DISK_CACHE_DIRECTORY, max_bytes: int = DEFAULT_DISK_CACHE_SIZE_MB << 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def path(self, key: str) -> str:
+        # keys are hex digests, the first two characters spread files over subdirectories
+        return os.path.join(self.directory, key[:2], key + CACHE_FILE_EXTENSION)
+
+    def load(self, key: str) -> Optional[npt.NDArray[np.floating]]:
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                pixels = data['pixels']
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            # unreadable leftovers, e.g. from a crash during a write
+            self.remove(path)
+            return None
+        # mark as recently used for eviction; another process may have evicted it since the read
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return pixels
+
+    def save(self, key: str, pixels: npt.NDArray[np.floating]) -> None:
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written next to the target and moved into place, so readers never see partial files
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'wb') as f:
+            np.savez_compressed(f, pixels=pixels)
+        os.replace(temporary_path, path)
+        self.evict()
+
+    def remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def evict(self) -> None:
+        entries = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith(CACHE_FILE_EXTENSION):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            self.remove(path)
+            total_bytes -= size
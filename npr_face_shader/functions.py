@@ -1,30 +1,115 @@
 import bpy
-import bmesh
 
+from typing import Callable, Optional
+from dataclasses import dataclass, replace
 from multiprocessing.pool import Pool
+import multiprocessing
+import os
+import queue
+import threading
 
 from .utils import *
+from .bake import StrokeGroup, BakeInputs, BakeSettings, BakeCancelled, BakeTask
+from .bake import bake_progressive, get_preview_scales, run_bake_task, run_bake_tasks, save_bundle
+from .bake import find_unique_frames, get_atlas_cells, cell_settings
+from .cli import write_shadow_map
+from .cache import StageCache, stage_cache
+from .disk_cache import DiskCache, DEFAULT_DISK_CACHE_DIRECTORY
+from .profiling import BakeProfiler
+from .workers import get_worker_count
+
+# stage report of the latest bake, for inspecting it from scripts
+last_bake_report: Optional[dict] = None
+
+def is_configured(obj: bpy.types.Object) -> bool:
+    return obj.face_shade_props.target is not None
+
+def get_settings_object(context: bpy.types.Context) -> Optional[bpy.types.Object]:
+    # settings are stored per object; the panel and operators use the active object's,
+    # or those of the setup the active object takes part in (its face mesh or one of its grease pencils)
+    active = context.object
+    if active is not None:
+        if is_configured(active):
+            return active
+        for obj in bpy.data.objects:
+            props = obj.face_shade_props
+            if active in (props.target, props.vertical_lines, props.shadow_shapes, props.highlight_shapes):
+                return obj
+        # a new setup starts on the face mesh
+        if active.type == 'MESH':
+            return active
+    # files set up before settings were per object keep them on the first object
+    return bpy.data.objects[0] if len(bpy.data.objects) > 0 else None
+
+def get_configured_objects(selected_only: bool = False) -> list[bpy.types.Object]:
+    objects = [obj for obj in bpy.data.objects if is_configured(obj)]
+    if selected_only:
+        objects = [obj for obj in objects if obj.select_get() or obj.face_shade_props.target.select_get()]
+    return objects
 
 def verify_property(prop: bpy.types.PointerProperty | None, data_class: bpy.types.ID):
     return prop is not None and isinstance(prop.data, data_class)
 
-def create_face_shadow_map(operator: bpy.types.Operator, pool: Pool):
-    props = bpy.data.objects[0].face_shade_props
+def extract_triangle_mesh(mesh: bpy.types.Mesh, uv_layer: bpy.types.MeshUVLoopLayer) -> TriangleMesh:
+    # loop triangles are already cached by blender, so the mesh can be read in bulk
+    mesh.calc_loop_triangles()
+    triangle_count = len(mesh.loop_triangles)
+
+    vertex_indices = np.empty(triangle_count * 3, dtype=np.int32)
+    mesh.loop_triangles.foreach_get('vertices', vertex_indices)
+    loop_indices = np.empty(triangle_count * 3, dtype=np.int32)
+    mesh.loop_triangles.foreach_get('loops', loop_indices)
+
+    coordinates = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get('co', coordinates)
+    loop_uvs = np.empty(len(mesh.loops) * 2, dtype=np.float32)
+    uv_layer.data.foreach_get('uv', loop_uvs)
+
+    return TriangleMesh(
+        positions=coordinates.reshape(-1, 3)[vertex_indices].reshape(-1, 3, 3),
+        uvs=loop_uvs.reshape(-1, 2)[loop_indices].reshape(-1, 3, 2),
+    )
+
+def read_stroke_points(stroke: bpy.types.GPencilStroke) -> npt.NDArray[np.float32]:
+    coordinates = np.empty(len(stroke.points) * 3, dtype=np.float32)
+    stroke.points.foreach_get('co', coordinates)
+    return coordinates.reshape(-1, 3)
+
+def write_image_pixels(image: bpy.types.Image, pixel_buffer: npt.NDArray[np.float32]) -> None:
+    # pixel_buffer is already in blender's layout for the image's channel count
+    image.pixels.foreach_set(pixel_buffer)
+    image.update()
 
+def get_layer_frame(layer: bpy.types.GPencilLayer, frame_number: Optional[int]) -> bpy.types.GPencilFrame:
+    # the keyframe shown at frame_number, every keyframe is held until the next one;
+    # without a frame number (or before the first keyframe) the first keyframe is used
+    if frame_number is None:
+        return layer.frames[0]
+    shown = [frame for frame in layer.frames if frame.frame_number <= frame_number]
+    return max(shown, key=lambda frame: frame.frame_number) if shown else layer.frames[0]
+
+def get_keyframe_numbers(objs: list[bpy.types.Object]) -> list[int]:
+    return sorted({frame.frame_number for obj in objs for layer in obj.data.layers for frame in layer.frames})
+
+def read_stroke_group(obj: bpy.types.Object, frame_number: Optional[int] = None) -> StrokeGroup:
+    strokes = get_first_non_empty_array([get_layer_frame(layer, frame_number).strokes for layer in obj.data.layers])
+    return StrokeGroup(
+        strokes=[read_stroke_points(stroke) for stroke in strokes or []],
+        matrix_world=np.array(obj.matrix_world)[0:3, 0:3],
+    )
+
+def read_bake_inputs(operator: bpy.types.Operator, props) -> Optional[tuple[BakeInputs, BakeSettings]]:
+    # reports the problem and returns None if the properties can't be baked
     target_obj = props.target
     if not verify_property(target_obj, bpy.types.Mesh):
         operator.report({'ERROR'}, 'Target object must be a valid mesh.')
         return
-    target_matrix_world = np.array(target_obj.matrix_world)[0:3, 0:3]
-
-    bm = bmesh.new()
-    bm.from_mesh(target_obj.data)
 
     if props.uv_map_name == '':
-        uv_map = bm.loops.layers.uv.active
+        uv_map = target_obj.data.uv_layers.active
     else:
         try:
-            uv_map = bm.loops.layers.uv[props.uv_map_name]
+            uv_map = target_obj.data.uv_layers[props.uv_map_name]
         except KeyError:
             operator.report({'ERROR'}, 'Invalid UV map name for target mesh.')
             return
@@ -33,157 +118,368 @@ def create_face_shadow_map(operator: bpy.types.Operator, pool: Pool):
     if not verify_property(face_lines_obj, bpy.types.GreasePencil):
         operator.report({'ERROR'}, 'Vertical lines must be a valid grease pencil.')
         return
-    face_lines_strokes = get_first_non_empty_array(
-        [layer.frames[0].strokes for layer in face_lines_obj.data.layers])
-    face_lines_matrix_world = np.array(face_lines_obj.matrix_world)[0:3, 0:3]
     
     shadow_shapes_obj = props.shadow_shapes
     if not verify_property(shadow_shapes_obj, bpy.types.GreasePencil):
         operator.report({'ERROR'}, 'Shadow shapes must be a valid grease pencil.')
         return
-    shadow_shapes_strokes = get_first_non_empty_array(
-        [layer.frames[0].strokes for layer in shadow_shapes_obj.data.layers])
-    shadow_shapes_matrix_world = np.array(shadow_shapes_obj.matrix_world)[0:3, 0:3]
     
     highlight_shapes_obj = props.highlight_shapes
     if not verify_property(highlight_shapes_obj, bpy.types.GreasePencil):
         operator.report({'ERROR'}, 'Highlight shapes must be a valid grease pencil.')
         return
-    highlight_shapes_strokes = get_first_non_empty_array(
-        [layer.frames[0].strokes for layer in highlight_shapes_obj.data.layers])
-    highlight_shapes_matrix_world = np.array(highlight_shapes_obj.matrix_world)[0:3, 0:3]
 
-    blur_size = props.blur_size
-    
     image = props.output_image
     if image is None:
         operator.report({'ERROR'}, 'Output image must be set.')
-    width = image.size[0]
-    height = image.size[1]
-    
-    # The image is grayscale so this is fine
-    image_pixels = np.array([0.0 for _ in range(width * height)])
-    
+        return
+    if props.pack_mirrored and image.channels < 3:
+        operator.report({'ERROR'}, 'Packing the mirrored map needs an output image with color channels.')
+        return
+
     # mesh has to be triangulated for barycentric conversion to work
     operator.report({'INFO'}, 'Triangulating mesh...')
-    triangulated = bmesh.ops.triangulate(bm, faces=bm.faces[:], quad_method='BEAUTY', ngon_method='BEAUTY')
-
-    simplified_target_mesh: list[Simple3DFace] = []
-    for face in triangulated['faces']:
-        simplified_target_mesh.append(Simple3DFace(
-            uvs=[np.array(loop[uv_map].uv) for loop in face.loops],
-            vertices=[np.array(vert.co) for vert in face.verts],
-        ))
-
-    lines_on_image = []
-    operator.report({'INFO'}, 'Mapping face strokes to UV coordinates...')
-    uv_projector = UVProjector(
-        triangulated_mesh=simplified_target_mesh,
-        mesh_matrix_world=target_matrix_world,
-        points_matrix_world=face_lines_matrix_world,
+    inputs = BakeInputs(
+        mesh=extract_triangle_mesh(target_obj.data, uv_map),
+        mesh_matrix_world=np.array(target_obj.matrix_world)[0:3, 0:3],
+        lines=read_stroke_group(face_lines_obj),
+        shadow_shapes=read_stroke_group(shadow_shapes_obj),
+        highlight_shapes=read_stroke_group(highlight_shapes_obj),
+        uv_map_name=props.uv_map_name,
     )
-    
-    face_lines_strokes = [[np.array(point.co) for point in stroke.points] for stroke in face_lines_strokes]
-    lines_on_image = pool.map(uv_projector, face_lines_strokes)
+    settings = BakeSettings(
+        width=image.size[0],
+        height=image.size[1],
+        blur_size=props.blur_size,
+        blur_type=props.blur_type,
+        blur_edge=props.blur_edge,
+        engine=props.engine,
+        exact_face_lookup=props.exact_face_lookup,
+        precision=props.precision,
+        use_tiles=props.use_tiles,
+        tile_size=props.tile_size,
+        simplify_tolerance=props.simplify_tolerance,
+        symmetry=props.symmetry,
+    )
+    return inputs, settings
 
-    lines_on_image[:] = sorted(lines_on_image, key=lambda line: find_average_x_value(line))
-    
-    operator.report({'INFO'}, 'Finding row intersection points...')
-    intersection_points = []
-    for line in lines_on_image:
-        intersections_for_line = []
-        for i in range(height):
-            segments = get_surrounding_values(i / height, line, lambda point: point[1])
-            if segments[0] is None:
-                intersections_for_line.append(segments[1][0])
-            elif segments[1] is None:
-                intersections_for_line.append(segments[0][0])
-            else:
-                intersections_for_line.append(get_line_x_from_y(i / height, segments[0], segments[1]))
-        intersection_points.append(intersections_for_line)
-    
-    operator.report({'INFO'}, 'Calculating base pixels...')
-
-    base_pixel_calculator = BasePixelCalculator(width, height, intersection_points)
-    image_pixels[:] = pool.map(base_pixel_calculator, range(width * height))
-
-    shadow_shapes_on_image: list[list[npt.NDArray[np.float64]]] = []
-    operator.report({'INFO'}, 'Mapping shadow shapes to UV coordinates...')
-    for stroke in shadow_shapes_strokes:
-        shadow_shape_stroke_points = [np.array(point.co) for point in stroke.points]
-        projected_points = project_points_to_uv(
-            triangulated_mesh=simplified_target_mesh,
-            mesh_matrix_world=target_matrix_world,
-            points=shadow_shape_stroke_points,
-            points_matrix_world=shadow_shapes_matrix_world,
-        )
-        shadow_shapes_on_image.append(projected_points)
-    
-    operator.report({'INFO'}, 'Closing off shadow shapes...')
-    shadow_shapes_on_image[:] = [close_2d_shape(shape) for shape in shadow_shapes_on_image]
-    
-    operator.report({'INFO'}, 'Calculating shadow pixels...')
-    for shape in shadow_shapes_on_image:
-        shape_center = find_2d_shape_center(shape) 
-        shape_max_distance_squared = find_2d_furthest_distance_squared(shape_center, shape)
-        
-        pixel_calculator = ShapePixelCalculator(
-            width=width,
-            height=height,
-            shape_center=shape_center,
-            shape_max_distance_squared=shape_max_distance_squared,
-            shape_points=shape,
-        )
+@dataclass
+class BakeJob:
+    # everything read from blender for one bake, so the bake itself doesn't touch blender data
+    inputs: BakeInputs
+    settings: BakeSettings
+    image: bpy.types.Image
+    channels: int
+    # the mirrored map goes into the green channel, for materials made with the same setting
+    pack_mirrored: bool
+    cache: StageCache
+    disk_cache: Optional[DiskCache]
+    profiler: BakeProfiler
+    log_file: str
+    # resolutions baked one after the other as a share of the image size, the last one is kept
+    scales: list[float]
 
-        shadow_pixels = pool.map(pixel_calculator, range(width * height))
-        for i, value in enumerate(shadow_pixels):
-            if value is not None:
-                set_pixel_blended(image_pixels, i, value ** 2 / 2.0)
-    
-    highlight_shapes_on_image: list[list[npt.NDArray[np.float64]]] = []
-    operator.report({'INFO'}, 'Mapping highlight shapes to UV coordinates...')
-    for stroke in highlight_shapes_strokes:
-        highlight_shape_stroke_points = [np.array(point.co) for point in stroke.points]
-        projected_points = project_points_to_uv(
-            triangulated_mesh=simplified_target_mesh,
-            mesh_matrix_world=target_matrix_world,
-            points=highlight_shape_stroke_points,
-            points_matrix_world=highlight_shapes_matrix_world,
-        )
-        highlight_shapes_on_image.append(projected_points)
-    
-    operator.report({'INFO'}, 'Closing off highlight shapes...')
-    highlight_shapes_on_image[:] = [close_2d_shape(shape) for shape in highlight_shapes_on_image]
-    
-    operator.report({'INFO'}, 'Calculating highlight pixels...')
-    for shape in highlight_shapes_on_image:
-        shape_center = find_2d_shape_center(shape)
-        shape_max_distance_squared = find_2d_furthest_distance_squared(shape_center, shape)
-
-        pixel_calculator = ShapePixelCalculator(
-            width=width,
-            height=height,
-            shape_center=shape_center,
-            shape_max_distance_squared=shape_max_distance_squared,
-            shape_points=shape,
+def write_job_pixels(job: BakeJob, pixel_buffer: npt.NDArray[np.float32], cells: Optional[list[Tile]] = None) -> None:
+    if job.pack_mirrored:
+        pixel_buffer = pack_mirrored_channel(pixel_buffer, job.settings.width, job.channels, cells)
+    write_image_pixels(job.image, pixel_buffer)
+
+def read_frame_inputs(
+        operator: bpy.types.Operator,
+        props,
+        every_frame: bool,
+        ) -> Optional[tuple[dict[int, BakeInputs], BakeSettings]]:
+    # the bake inputs at every keyframe of the guide objects, or at every frame from the first keyframe
+    # to the last; the mesh is read once and shared by all of them
+    bake_inputs = read_bake_inputs(operator, props)
+    if bake_inputs is None:
+        return None
+    inputs, settings = bake_inputs
+
+    guides = [props.vertical_lines, props.shadow_shapes, props.highlight_shapes]
+    keyframes = get_keyframe_numbers(guides)
+    if not keyframes:
+        operator.report({'ERROR'}, 'The grease pencil objects have no keyframes.')
+        return None
+    frame_numbers = range(keyframes[0], keyframes[-1] + 1) if every_frame else keyframes
+
+    # held keyframes are only read once
+    groups: dict[tuple, StrokeGroup] = {}
+
+    def read_held_group(obj: bpy.types.Object, frame_number: int) -> StrokeGroup:
+        key = (obj.name, tuple(get_layer_frame(layer, frame_number).frame_number for layer in obj.data.layers))
+        if key not in groups:
+            groups[key] = read_stroke_group(obj, frame_number)
+        return groups[key]
+
+    frames = {
+        frame_number: replace(
+            inputs,
+            lines=read_held_group(props.vertical_lines, frame_number),
+            shadow_shapes=read_held_group(props.shadow_shapes, frame_number),
+            highlight_shapes=read_held_group(props.highlight_shapes, frame_number),
         )
-        
-        highlight_pixels = pool.map(pixel_calculator, range(width * height))
-        for i, value in enumerate(highlight_pixels):
-            if value is not None:
-                set_pixel_blended(image_pixels, i, (1 - value ** 2) / 2.0 + 0.5)
-
-    operator.report({'INFO'}, 'Blurring final result...')
-    gaussian_kernel = build_box_kernel(blur_size)
-    image_pixels_2d = image_pixels.reshape((height, width))
-    image_pixels_2d = np.apply_along_axis(lambda x: np.convolve(x, gaussian_kernel, mode='same'), 0, image_pixels_2d)
-    image_pixels_2d = np.apply_along_axis(lambda x: np.convolve(x, gaussian_kernel, mode='same'), 1, image_pixels_2d)
-    image_pixels = image_pixels_2d.reshape(width * height)
-    
-    operator.report({'INFO'}, 'Updating image...')
-    converted = []
-    for value in image_pixels:
-        converted.extend([value, value, value, 1.0])
-    image.pixels[:] = converted
+        for frame_number in frame_numbers
+    }
+    return frames, settings
+
+def create_bake_job(props, inputs: BakeInputs, settings: BakeSettings, profiler: BakeProfiler, scales: list[float]) -> BakeJob:
+    return BakeJob(
+        inputs=inputs,
+        settings=settings,
+        image=props.output_image,
+        channels=props.output_image.channels,
+        pack_mirrored=props.pack_mirrored,
+        # every stage is keyed by the content it was computed from, so unchanged stages are reused
+        cache=stage_cache if props.use_cache else StageCache(max_bytes=0),
+        disk_cache=DiskCache(bpy.path.abspath(props.disk_cache_directory) or DEFAULT_DISK_CACHE_DIRECTORY,
+                             props.disk_cache_size << 20) if props.use_disk_cache else None,
+        profiler=profiler,
+        log_file=bpy.path.abspath(props.bake_log_file) if props.bake_log_file != '' else '',
+        scales=scales,
+    )
+
+def prepare_bake(operator: bpy.types.Operator, props, preview: bool = False) -> Optional[BakeJob]:
+    profiler = BakeProfiler(trace_memory=props.profile_memory)
+    with profiler.stage('read_inputs'):
+        bake_inputs = read_bake_inputs(operator, props)
+    if bake_inputs is None:
+        return None
+    inputs, settings = bake_inputs
+    scales = get_preview_scales(props.preview_scale, props.refine_preview) if preview else [1.0]
+    return create_bake_job(props, inputs, settings, profiler, scales)
+
+def prepare_frame_bake(operator: bpy.types.Operator, props) -> Optional[tuple[BakeJob, dict[int, BakeInputs]]]:
+    profiler = BakeProfiler(trace_memory=props.profile_memory)
+    with profiler.stage('read_inputs'):
+        frame_inputs = read_frame_inputs(operator, props, every_frame=props.frames_output == 'SEQUENCE')
+    if frame_inputs is None:
+        return None
+    frames, settings = frame_inputs
+    profiler.counts['frames_read'] = len(frames)
+    return create_bake_job(props, frames[min(frames)], settings, profiler, [1.0]), frames
+
+def run_bake(
+        job: BakeJob,
+        pool: Pool,
+        write_pixels: Callable[[npt.NDArray[np.float32]], None],
+        report: Callable[[str], None],
+        progress: Optional[Callable[[float], None]] = None,
+        ) -> None:
+    bake_progressive(
+        job.inputs,
+        job.settings,
+        write_pixels=write_pixels,
+        scales=job.scales,
+        channels=job.channels,
+        pool=pool,
+        cache=job.cache,
+        disk_cache=job.disk_cache,
+        report=report,
+        profiler=job.profiler,
+        progress=progress,
+    )
+
+def finish_bake(operator: bpy.types.Operator, job: BakeJob) -> None:
+    global last_bake_report
+    last_bake_report = job.profiler.to_dict()
+    operator.report({'INFO'}, job.profiler.summary())
+    if job.log_file != '':
+        job.profiler.write(job.log_file)
+
+def create_face_shadow_map(operator: bpy.types.Operator, pool: Pool, props, preview: bool = False):
+    job = prepare_bake(operator, props, preview)
+    if job is None:
+        return
+    run_bake(
+        job,
+        pool,
+        write_pixels=lambda pixel_buffer: write_job_pixels(job, pixel_buffer),
+        report=lambda message: operator.report({'INFO'}, message),
+    )
+    finish_bake(operator, job)
+
+
+class BackgroundBake:
+    # runs a prepared bake on a separate thread; blender data may only be touched from the main
+    # thread, so finished pixels are handed over and written there by apply_pending_pixels
+
+    def __init__(self, job: BakeJob, pool: Pool):
+        self.job = job
+        self.pool = pool
+        self.messages: queue.Queue[str] = queue.Queue()
+        self.progress = 0.0
+        self.cancel_requested = threading.Event()
+        self.cancelled = False
+        self.error: Optional[Exception] = None
+        self.pending_pixels: Optional[npt.NDArray[np.float32]] = None
+        self.pixels_written = threading.Event()
+        # every pass writes once, the last one is the finished map
+        self.writes_left = len(job.scales)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def cancel(self) -> None:
+        # takes effect at the next stage or tile, a running pool map is always finished first
+        self.cancel_requested.set()
+
+    def is_running(self) -> bool:
+        return self.thread.is_alive()
 
-    operator.report({'INFO'}, 'Finished!')
+    def check_cancelled(self) -> None:
+        # once the finished map is in the image, the bake is completed even if cancelled
+        if self.cancel_requested.is_set() and self.writes_left > 0:
+            raise BakeCancelled()
+
+    def report(self, message: str) -> None:
+        self.check_cancelled()
+        self.messages.put(message)
+
+    def set_progress(self, fraction: float) -> None:
+        self.check_cancelled()
+        self.progress = fraction
+
+    def write_pixels(self, pixel_buffer: npt.NDArray[np.float32]) -> None:
+        # tiled buffers are only valid until this returns, so wait for the main thread to copy them
+        self.pixels_written.clear()
+        self.pending_pixels = pixel_buffer
+        while not self.pixels_written.wait(0.05):
+            self.check_cancelled()
+        self.writes_left -= 1
+
+    def apply_pending_pixels(self) -> None:
+        if self.pending_pixels is not None:
+            write_job_pixels(self.job, self.pending_pixels)
+            self.pending_pixels = None
+            self.pixels_written.set()
+
+    def run(self) -> None:
+        try:
+            run_bake(self.job, self.pool, self.write_pixels, self.report, self.set_progress)
+        except BakeCancelled:
+            self.cancelled = True
+        except Exception as e:
+            self.error = e
+
+class BatchBake:
+    # runs whole bakes as tasks of the worker pool, one per target, so a cast of characters uses every core;
+    # finished results are collected on the main thread by poll
+
+    def __init__(self, jobs: dict[str, BakeJob], pool: Pool):
+        self.jobs = jobs
+        tasks = [
+            BakeTask(
+                name=name,
+                inputs=job.inputs,
+                settings=job.settings,
+                disk_cache=job.disk_cache,
+                use_cache=job.cache.max_bytes > 0,
+                profiler=job.profiler,
+            )
+            for name, job in jobs.items()
+        ]
+        # largest images first, so a big one doesn't start last and hold up the end of the batch
+        tasks.sort(key=lambda task: task.settings.width * task.settings.height, reverse=True)
+        self.results = pool.imap_unordered(run_bake_task, tasks, chunksize=1)
+        self.finished = 0
+
+    def is_running(self) -> bool:
+        return self.finished < len(self.jobs)
+
+    def poll(self) -> list[tuple[str, BakeJob, Optional[str]]]:
+        # writes every bake finished since the last call into its image,
+        # returns (name, job, error message) for each of them
+        done = []
+        while self.is_running():
+            try:
+                name, pixels, profiler, error = self.results.next(timeout=0)
+            except multiprocessing.TimeoutError:
+                break
+            self.finished += 1
+            job = self.jobs[name]
+            job.profiler = profiler
+            if error is None:
+                write_job_pixels(job, build_image_buffer(pixels, job.channels))
+            done.append((name, job, error))
+        return done
+
+class FrameBake:
+    # bakes the guide strokes of every frame as tasks of the worker pool, frames with the same strokes
+    # are baked once; with a directory every frame is saved there as a png, otherwise the frames are
+    # laid out as an atlas in the job's image, which is written once all of them are done
+
+    def __init__(self, job: BakeJob, frames: dict[int, BakeInputs], directory: str, pool: Pool):
+        self.job = job
+        self.directory = directory
+        self.unique_frames = find_unique_frames(frames)
+        self.frame_count = len(frames)
+        self.cells = {}
+        self.atlas = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        else:
+            self.cells = dict(zip(sorted(frames), get_atlas_cells(len(frames), job.settings.width, job.settings.height)))
+            self.atlas = np.zeros((job.settings.height, job.settings.width), dtype=np.float32)
+
+        tasks = [
+            BakeTask(
+                name=str(frame),
+                inputs=frames[frame],
+                settings=job.settings if directory else cell_settings(job.settings, self.cells[frame]),
+                disk_cache=job.disk_cache,
+                use_cache=job.cache.max_bytes > 0,
+                profiler=BakeProfiler(trace_memory=job.profiler.trace_memory),
+            )
+            for frame in self.unique_frames
+        ]
+        # neighbouring frames share most strokes, so workers get runs of them and reuse the face lookup
+        # and the projections of unchanged strokes from their own stage cache; two runs per worker still
+        # leave some room for balancing
+        run_length = -(-len(tasks) // (2 * get_worker_count()))
+        runs = [tasks[start:start + run_length] for start in range(0, len(tasks), run_length)]
+        self.results = pool.imap_unordered(run_bake_tasks, runs, chunksize=1)
+        self.task_count = len(tasks)
+        self.finished = 0
+
+    def is_running(self) -> bool:
+        return self.finished < self.task_count
+
+    def get_frame_path(self, frame: int) -> str:
+        return os.path.join(self.directory, f'{self.job.image.name}_{frame:04d}.png')
+
+    def poll(self) -> list[tuple[list[int], Optional[str]]]:
+        # saves every frame finished since the last call, returns (frames with those strokes, error message)
+        # for each of them; the atlas is written to the image after the last one
+        done = []
+        while self.is_running():
+            try:
+                results = self.results.next(timeout=0)
+            except multiprocessing.TimeoutError:
+                break
+            for name, pixels, profiler, error in results:
+                self.finished += 1
+                frames = self.unique_frames[int(name)]
+                done.append((frames, error))
+                if error is not None:
+                    continue
+                self.job.profiler.stages.extend(profiler.stages)
+                self.job.profiler.counts.setdefault('frames', {})[name] = profiler.counts
+                for frame in frames:
+                    if self.directory:
+                        write_shadow_map(self.get_frame_path(frame), pixels.reshape(-1, self.job.settings.width))
+                    else:
+                        cell = self.cells[frame]
+                        self.atlas[cell.slices()] = pixels.reshape(cell.height, cell.width)
+        if self.atlas is not None and done and not self.is_running():
+            write_job_pixels(self.job, build_image_buffer(self.atlas.reshape(-1), self.job.channels), list(self.cells.values()))
+        return done
+
+def export_bake_bundle(operator: bpy.types.Operator, filepath: str, props):
+    # everything the bake needs in one file, for baking outside of blender with the cli
+    bake_inputs = read_bake_inputs(operator, props)
+    if bake_inputs is None:
+        return
+    save_bundle(filepath, *bake_inputs)
+    operator.report({'INFO'}, f'Saved bake bundle to {filepath}.')
@@ -1,11 +1,15 @@
 import bpy
+from bpy_extras.io_utils import ExportHelper
 
-from multiprocessing.pool import Pool
+from typing import Optional
 import json
 import os
 
 from . import functions
 from . import nodes
+from . import workers
+from .tiled import DEFAULT_TILE_SIZE
+from .disk_cache import DEFAULT_DISK_CACHE_SIZE_MB
 
 
 NODE_GROUP_NAME = 'NPR Face Shadows'
@@ -17,6 +21,50 @@ def get_absolute_path(relative_path: str) -> str:
     root_dir = os.path.dirname(os.path.dirname(__file__))
     return os.path.join(root_dir, relative_path)
 
+def get_node_group() -> bpy.types.NodeTree:
+    # loaded from the json once and shared by every material
+    if NODE_GROUP_NAME in bpy.data.node_groups:
+        return bpy.data.node_groups[NODE_GROUP_NAME]
+    with open(get_absolute_path(NODE_GROUP_FILE), 'r') as f:
+        node_group_data = json.load(f)
+        return nodes.write_shader_node_group(NODE_GROUP_NAME, node_group_data)
+
+def create_material(operator: bpy.types.Operator, props) -> bool:
+    if props.target == None:
+        uv_map = props.uv_map_name
+    elif props.uv_map_name == '':
+        uv_map = props.target.data.uv_layers.active.name
+    else:
+        try:
+            uv_map = props.target.data.uv_layers[props.uv_map_name].name
+        except KeyError:
+            operator.report({'ERROR'}, 'Invalid UV map name for target mesh.')
+            return False
+
+    nodes.create_material(
+        props.material_name,
+        get_node_group(),
+        image=props.output_image, # can be None
+        uv_map=uv_map,
+        sun_driver_obj=props.sun_driver,
+        head_driver_obj=props.head_driver,
+        packed=props.pack_mirrored,
+    )
+    return True
+
+def apply_material(operator: bpy.types.Operator, props) -> None:
+    # materials that already exist are reused as they are
+    if props.material_name == '':
+        return
+    if props.material_name not in bpy.data.materials and not create_material(operator, props):
+        return
+    props.target.active_material = bpy.data.materials[props.material_name]
+
+def is_baking() -> bool:
+    # bakes share the stage cache and the worker pool, so only one runs at a time
+    return ComputeFaceShadows.running_bake is not None or BatchComputeFaceShadows.running_batch is not None \
+        or ComputeAnimatedFaceShadows.running_frames is not None
+
 class FaceShadeProps(bpy.types.PropertyGroup):
 
     target: bpy.props.PointerProperty(name='Target Object', type=bpy.types.Object)
@@ -25,10 +73,77 @@ class FaceShadeProps(bpy.types.PropertyGroup):
     highlight_shapes: bpy.props.PointerProperty(name='Highlight Shapes', type=bpy.types.Object)
     output_image: bpy.props.PointerProperty(name='Output Image', type=bpy.types.Image)
     blur_size: bpy.props.IntProperty(name='Blur Size', default=25, min=1)
+    blur_type: bpy.props.EnumProperty(
+        name='Blur Type',
+        items=[
+            ('BOX', 'Box', 'Flat average over the blur size'),
+            ('ITERATED_BOX', 'Fast Gaussian', 'Three box passes approximating a gaussian'),
+            ('GAUSSIAN', 'Gaussian', 'True gaussian kernel spanning the blur size'),
+        ],
+        default='BOX',
+    )
+    blur_edge: bpy.props.EnumProperty(
+        name='Blur Edges',
+        items=[
+            ('ZERO', 'Zero', 'Treat pixels outside the image as black'),
+            ('EXTEND', 'Extend', 'Repeat the pixels on the image border'),
+            ('REFLECT', 'Reflect', 'Mirror the image at its border'),
+        ],
+        default='ZERO',
+    )
     material_name: bpy.props.StringProperty(name='Material Name', default=DEFAULT_MATERIAL_NAME)
+    pack_mirrored: bpy.props.BoolProperty(name='Pack Mirrored Map', default=False)
     uv_map_name: bpy.props.StringProperty(name='UV Map Name')
     sun_driver: bpy.props.PointerProperty(name='Sun Driver Target', type=bpy.types.Object)
     head_driver: bpy.props.PointerProperty(name='Head Driver Target', type=bpy.types.Object)
+    engine: bpy.props.EnumProperty(
+        name='Engine',
+        items=[
+            ('NUMPY', 'Vectorized', 'Compute whole-image stages as NumPy array operations'),
+            ('POOL', 'Multiprocessing', 'Compute every pixel separately across a process pool'),
+        ],
+        default='NUMPY',
+    )
+    exact_face_lookup: bpy.props.BoolProperty(name='Exact Face Lookup', default=False)
+    precision: bpy.props.EnumProperty(
+        name='Precision',
+        items=[
+            ('DOUBLE', 'Double', 'Compute in 64-bit floats'),
+            ('SINGLE', 'Single', 'Compute in 32-bit floats, like the image itself stores, using half the memory'),
+        ],
+        default='DOUBLE',
+    )
+    simplify_tolerance: bpy.props.FloatProperty(name='Stroke Simplification', default=0.0, min=0.0, soft_max=2.0)
+    symmetry: bpy.props.EnumProperty(
+        name='Symmetry',
+        items=[
+            ('OFF', 'Off', 'Bake every pixel'),
+            ('DETECT', 'Detect', 'Bake one half and mirror it when the vertical lines mirror each other'),
+            ('MIRROR', 'Mirror Lines', 'Make the vertical lines mirror each other, then bake one half and mirror it'),
+        ],
+        default='OFF',
+    )
+    use_cache: bpy.props.BoolProperty(name='Reuse Unchanged Stages', default=True)
+    use_tiles: bpy.props.BoolProperty(name='Tiled Rendering', default=False)
+    tile_size: bpy.props.IntProperty(name='Tile Size', default=DEFAULT_TILE_SIZE, min=64)
+    use_disk_cache: bpy.props.BoolProperty(name='Disk Cache', default=False)
+    disk_cache_directory: bpy.props.StringProperty(name='Cache Directory', default='', subtype='DIR_PATH')
+    disk_cache_size: bpy.props.IntProperty(name='Cache Size (MB)', default=DEFAULT_DISK_CACHE_SIZE_MB, min=1)
+    background_bake: bpy.props.BoolProperty(name='Bake in Background', default=True)
+    preview_scale: bpy.props.FloatProperty(
+        name='Preview Resolution', default=0.25, min=0.01, max=1.0, subtype='FACTOR')
+    refine_preview: bpy.props.BoolProperty(name='Refine to Full Resolution', default=False)
+    profile_memory: bpy.props.BoolProperty(name='Track Peak Memory', default=False)
+    bake_log_file: bpy.props.StringProperty(name='Bake Log File', default='', subtype='FILE_PATH')
+    frames_output: bpy.props.EnumProperty(
+        name='Animated Output',
+        items=[
+            ('SEQUENCE', 'Image Sequence', 'Save every frame as a numbered png'),
+            ('ATLAS', 'Atlas', 'Lay out every keyframe side by side in the output image'),
+        ],
+        default='SEQUENCE',
+    )
+    frames_directory: bpy.props.StringProperty(name='Sequence Directory', default='//face_shadows', subtype='DIR_PATH')
 
 class ComputeFaceShadows(bpy.types.Operator):
     bl_idname = 'object.npr_shade_face'
@@ -36,17 +151,245 @@ class ComputeFaceShadows(bpy.types.Operator):
     bl_description = 'Use the specified lines and parameters to generate a custom face shadow image.'
     bl_options = {'REGISTER', 'UNDO'}
 
+    running_bake: Optional[functions.BackgroundBake] = None
+
+    preview: bpy.props.BoolProperty(name='Preview', default=False, options={'SKIP_SAVE'})
+
+    @classmethod
+    def poll(cls, context):
+        obj = context.object
+        return obj is not None and obj.mode == 'OBJECT' and not is_baking()
+
+    def execute(self, context):
+        settings_object = functions.get_settings_object(context)
+        props: FaceShadeProps = settings_object.face_shade_props
+        if not props.background_bake:
+            functions.create_face_shadow_map(self, workers.get_worker_pool(), props, self.preview)
+            apply_material(self, props)
+            return {'FINISHED'}
+
+        # the settings are looked up again when the bake is done, the object may have been changed meanwhile
+        self.settings_object_name = settings_object.name
+
+        job = functions.prepare_bake(self, props, self.preview)
+        if job is None:
+            return {'CANCELLED'}
+        bake = functions.BackgroundBake(job, workers.get_worker_pool())
+        ComputeFaceShadows.running_bake = bake
+        bake.start()
+
+        window_manager = context.window_manager
+        self.timer = window_manager.event_timer_add(0.1, window=context.window)
+        window_manager.progress_begin(0, 100)
+        window_manager.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        bake = ComputeFaceShadows.running_bake
+        if event.type == 'ESC' and event.value == 'PRESS':
+            bake.cancel()
+            context.workspace.status_text_set('Cancelling face shading...')
+            return {'RUNNING_MODAL'}
+        if event.type != 'TIMER':
+            # everything else goes on as usual while the bake runs
+            return {'PASS_THROUGH'}
+
+        bake.apply_pending_pixels()
+        while not bake.messages.empty():
+            message = bake.messages.get()
+            self.report({'INFO'}, message)
+            if not bake.cancel_requested.is_set():
+                context.workspace.status_text_set(f'Face shading: {message} (Esc to cancel)')
+        context.window_manager.progress_update(int(bake.progress * 100))
+        if bake.is_running():
+            return {'PASS_THROUGH'}
+
+        self.end_modal(context)
+        if bake.cancelled:
+            self.report({'WARNING'}, 'Face shading cancelled.')
+            return {'CANCELLED'}
+        if bake.error is not None:
+            self.report({'ERROR'}, f'Face shading failed: {bake.error}')
+            return {'CANCELLED'}
+        functions.finish_bake(self, bake.job)
+        settings_object = bpy.data.objects.get(self.settings_object_name)
+        if settings_object is not None:
+            apply_material(self, settings_object.face_shade_props)
+        return {'FINISHED'}
+
+    def end_modal(self, context):
+        window_manager = context.window_manager
+        window_manager.event_timer_remove(self.timer)
+        window_manager.progress_end()
+        context.workspace.status_text_set(None)
+        ComputeFaceShadows.running_bake = None
+
+class BatchComputeFaceShadows(bpy.types.Operator):
+    bl_idname = 'object.npr_shade_face_batch'
+    bl_label = 'NPR Shade Face Batch'
+    bl_description = 'Generate face shading for every object with face shader settings at once.'
+    bl_options = {'REGISTER', 'UNDO'}
+
+    running_batch: Optional[functions.BatchBake] = None
+
+    selected_only: bpy.props.BoolProperty(
+        name='Selected Only', default=False, description='Only bake setups whose object or target is selected')
+
+    @classmethod
+    def poll(cls, context):
+        obj = context.object
+        return (obj is None or obj.mode == 'OBJECT') and not is_baking()
+
+    def execute(self, context):
+        jobs = {}
+        for obj in functions.get_configured_objects(self.selected_only):
+            job = functions.prepare_bake(self, obj.face_shade_props)
+            if job is None:
+                self.report({'WARNING'}, f'Skipping {obj.name}, its settings are incomplete.')
+                continue
+            jobs[obj.name] = job
+        if not jobs:
+            self.report({'ERROR'}, 'No objects with complete face shader settings found.')
+            return {'CANCELLED'}
+
+        self.failures = 0
+        BatchComputeFaceShadows.running_batch = functions.BatchBake(jobs, workers.get_worker_pool())
+
+        window_manager = context.window_manager
+        self.timer = window_manager.event_timer_add(0.1, window=context.window)
+        window_manager.progress_begin(0, len(jobs))
+        window_manager.modal_handler_add(self)
+        context.workspace.status_text_set(f'Face shading 0 of {len(jobs)} targets (Esc to cancel)')
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        batch = BatchComputeFaceShadows.running_batch
+        if event.type == 'ESC' and event.value == 'PRESS':
+            # the pool is stopped with the bakes still running in it and started again on next use
+            workers.close_worker_pool()
+            self.end_modal(context)
+            self.report({'WARNING'}, f'Face shading cancelled after {batch.finished} of {len(batch.jobs)} targets.')
+            return {'CANCELLED'}
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        for name, job, error in batch.poll():
+            if error is not None:
+                self.failures += 1
+                self.report({'ERROR'}, f'Face shading {name} failed: {error}')
+                continue
+            functions.finish_bake(self, job)
+            settings_object = bpy.data.objects.get(name)
+            if settings_object is not None:
+                apply_material(self, settings_object.face_shade_props)
+        context.window_manager.progress_update(batch.finished)
+        context.workspace.status_text_set(
+            f'Face shading {batch.finished} of {len(batch.jobs)} targets (Esc to cancel)')
+        if batch.is_running():
+            return {'PASS_THROUGH'}
+
+        self.end_modal(context)
+        self.report({'INFO'}, f'Finished face shading {len(batch.jobs) - self.failures} of {len(batch.jobs)} targets.')
+        return {'FINISHED'}
+
+    def end_modal(self, context):
+        window_manager = context.window_manager
+        window_manager.event_timer_remove(self.timer)
+        window_manager.progress_end()
+        context.workspace.status_text_set(None)
+        BatchComputeFaceShadows.running_batch = None
+
+class ComputeAnimatedFaceShadows(bpy.types.Operator):
+    bl_idname = 'object.npr_shade_face_frames'
+    bl_label = 'NPR Shade Face Animated'
+    bl_description = 'Generate face shading for every keyframe of the grease pencil objects.'
+    bl_options = {'REGISTER', 'UNDO'}
+
+    running_frames: Optional[functions.FrameBake] = None
+
+    @classmethod
+    def poll(cls, context):
+        obj = context.object
+        return obj is not None and obj.mode == 'OBJECT' and not is_baking()
+
+    def execute(self, context):
+        settings_object = functions.get_settings_object(context)
+        props: FaceShadeProps = settings_object.face_shade_props
+        prepared = functions.prepare_frame_bake(self, props)
+        if prepared is None:
+            return {'CANCELLED'}
+        job, frames = prepared
+        directory = bpy.path.abspath(props.frames_directory) if props.frames_output == 'SEQUENCE' else ''
+        frame_bake = functions.FrameBake(job, frames, directory, workers.get_worker_pool())
+        ComputeAnimatedFaceShadows.running_frames = frame_bake
+        self.settings_object_name = settings_object.name
+        self.failures = 0
+        self.report({'INFO'}, f'Baking {len(frame_bake.unique_frames)} different frames out of {len(frames)}.')
+
+        window_manager = context.window_manager
+        self.timer = window_manager.event_timer_add(0.1, window=context.window)
+        window_manager.progress_begin(0, frame_bake.task_count)
+        window_manager.modal_handler_add(self)
+        context.workspace.status_text_set(f'Face shading 0 of {frame_bake.task_count} frames (Esc to cancel)')
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        frame_bake = ComputeAnimatedFaceShadows.running_frames
+        if event.type == 'ESC' and event.value == 'PRESS':
+            # the pool is stopped with the bakes still running in it and started again on next use
+            workers.close_worker_pool()
+            self.end_modal(context)
+            self.report({'WARNING'}, f'Face shading cancelled after {frame_bake.finished} of {frame_bake.task_count} frames.')
+            return {'CANCELLED'}
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        for frames, error in frame_bake.poll():
+            if error is not None:
+                self.failures += 1
+                self.report({'ERROR'}, f'Face shading frame {frames[0]} failed: {error}')
+        context.window_manager.progress_update(frame_bake.finished)
+        context.workspace.status_text_set(
+            f'Face shading {frame_bake.finished} of {frame_bake.task_count} frames (Esc to cancel)')
+        if frame_bake.is_running():
+            return {'PASS_THROUGH'}
+
+        self.end_modal(context)
+        functions.finish_bake(self, frame_bake.job)
+        if frame_bake.directory:
+            self.report({'INFO'}, f'Saved {frame_bake.frame_count} frames to {frame_bake.directory}.')
+        else:
+            settings_object = bpy.data.objects.get(self.settings_object_name)
+            if settings_object is not None:
+                apply_material(self, settings_object.face_shade_props)
+        if self.failures:
+            self.report({'WARNING'}, f'{self.failures} of {frame_bake.task_count} frames failed.')
+        return {'FINISHED'}
+
+    def end_modal(self, context):
+        window_manager = context.window_manager
+        window_manager.event_timer_remove(self.timer)
+        window_manager.progress_end()
+        context.workspace.status_text_set(None)
+        ComputeAnimatedFaceShadows.running_frames = None
+
+class ExportBakeBundle(bpy.types.Operator, ExportHelper):
+    bl_idname = 'object.npr_shade_face_export_bundle'
+    bl_label = 'Export Bake Bundle'
+    bl_description = 'Save the mesh, strokes and parameters to a file that can be baked without Blender.'
+    bl_options = {'REGISTER'}
+
+    filename_ext = '.npz'
+    filter_glob: bpy.props.StringProperty(default='*.npz', options={'HIDDEN'})
+
     @classmethod
     def poll(cls, context):
         obj = context.object
         return obj is not None and obj.mode == 'OBJECT'
 
     def execute(self, context):
-        with Pool(processes=8) as pool:
-            functions.create_face_shadow_map(self, pool)
-        bpy.ops.object.npr_shade_face_create_material()
-        props: FaceShadeProps = bpy.data.objects[0].face_shade_props
-        props.target.active_material = bpy.data.materials[props.material_name]
+        props: FaceShadeProps = functions.get_settings_object(context).face_shade_props
+        functions.export_bake_bundle(self, self.filepath, props)
         return {'FINISHED'}
 
 class CreateMaterialOnly(bpy.types.Operator):
@@ -60,38 +403,10 @@ class CreateMaterialOnly(bpy.types.Operator):
         return True
 
     def execute(self, context):
-        props: FaceShadeProps = bpy.data.objects[0].face_shade_props
-
-        if props.target == None:
-            uv_map = props.uv_map_name
-        elif props.uv_map_name == '':
-            uv_map = props.target.data.uv_layers.active.name
-        else:
-            try:
-                uv_map = props.target.data.uv_layers[props.uv_map_name].name
-            except KeyError:
-                self.report({'ERROR'}, 'Invalid UV map name for target mesh.')
-
-        if NODE_GROUP_NAME in bpy.data.node_groups:
-            node_group = bpy.data.node_groups[NODE_GROUP_NAME]
-        else:
-            with open(get_absolute_path(NODE_GROUP_FILE), 'r') as f:
-                node_group_data = json.load(f)
-                node_group = nodes.write_shader_node_group(NODE_GROUP_NAME, node_group_data)
-        
-        image = props.output_image # can be None
-        material_name = props.material_name
-
-        if material_name != '' and material_name not in bpy.data.materials:
-            nodes.create_material(
-                material_name,
-                node_group,
-                image=image,
-                uv_map=uv_map,
-                sun_driver_obj=props.sun_driver,
-                head_driver_obj=props.head_driver,
-            )
-            self.report({'INFO'}, 'Finished creating material!')
+        props: FaceShadeProps = functions.get_settings_object(context).face_shade_props
+        if props.material_name != '' and props.material_name not in bpy.data.materials:
+            if create_material(self, props):
+                self.report({'INFO'}, 'Finished creating material!')
         else:
             self.report({'INFO'}, 'Material already exists, exiting operator.')
         
@@ -126,21 +441,50 @@ class FaceShadePanel(bpy.types.Panel):
     bl_label = 'NPR Face Shader'
 
     def draw(self, context):
-        props = bpy.data.objects[0].face_shade_props
         layout = self.layout
+        settings_object = functions.get_settings_object(context)
+        if settings_object is None:
+            layout.label(text='Add an object to set up face shading.')
+            return
+        props = settings_object.face_shade_props
 
         col = layout.column(align=True)
+        col.row(align=True).label(text=f'Settings of {settings_object.name}')
         col.row(align=True).prop(props, 'target', text='Target Object')
         col.row(align=True).prop(props, 'vertical_lines', text='Vertical Lines')
         col.row(align=True).prop(props, 'shadow_shapes', text='Shadow Shapes')
         col.row(align=True).prop(props, 'highlight_shapes', text='Highlight Shapes')
         col.row(align=True).prop(props, 'output_image', text='Output Image')
         col.row(align=True).prop(props, 'blur_size', text='Blur Size')
+        col.row(align=True).prop(props, 'blur_type', text='Blur Type')
+        col.row(align=True).prop(props, 'blur_edge', text='Blur Edges')
 
         col.separator()
 
         col.row(align=True).prop(props, 'material_name', text='Material Name')
+        col.row(align=True).prop(props, 'pack_mirrored', text='Pack Mirrored Map')
         col.row(align=True).prop(props, 'uv_map_name', text='UV Map Name')
+        col.row(align=True).prop(props, 'engine', text='Engine')
+        col.row(align=True).prop(props, 'exact_face_lookup', text='Exact Face Lookup')
+        col.row(align=True).prop(props, 'precision', text='Precision')
+        col.row(align=True).prop(props, 'simplify_tolerance', text='Stroke Simplification')
+        col.row(align=True).prop(props, 'symmetry', text='Symmetry')
+        col.row(align=True).prop(props, 'use_cache', text='Reuse Unchanged Stages')
+        col.row(align=True).prop(props, 'use_tiles', text='Tiled Rendering')
+        if props.use_tiles:
+            col.row(align=True).prop(props, 'tile_size', text='Tile Size')
+        col.row(align=True).prop(props, 'use_disk_cache', text='Disk Cache')
+        if props.use_disk_cache:
+            col.row(align=True).prop(props, 'disk_cache_directory', text='Cache Directory')
+            col.row(align=True).prop(props, 'disk_cache_size', text='Cache Size (MB)')
+        col.row(align=True).prop(props, 'background_bake', text='Bake in Background')
+        col.row(align=True).prop(props, 'preview_scale', text='Preview Resolution')
+        col.row(align=True).prop(props, 'refine_preview', text='Refine to Full Resolution')
+        col.row(align=True).prop(props, 'profile_memory', text='Track Peak Memory')
+        col.row(align=True).prop(props, 'bake_log_file', text='Bake Log File')
+        col.row(align=True).prop(props, 'frames_output', text='Animated Output')
+        if props.frames_output == 'SEQUENCE':
+            col.row(align=True).prop(props, 'frames_directory', text='Sequence Directory')
 
         col.separator()
 
@@ -155,6 +499,26 @@ class FaceShadePanel(bpy.types.Panel):
             text='Generate Face Shading'
         )
 
+        col.row(align=True).operator(
+            operator=ComputeFaceShadows.bl_idname,
+            text='Preview Face Shading'
+        ).preview = True
+
+        col.row(align=True).operator(
+            operator=BatchComputeFaceShadows.bl_idname,
+            text='Generate All Face Shading'
+        )
+
+        col.row(align=True).operator(
+            operator=BatchComputeFaceShadows.bl_idname,
+            text='Generate Selected Face Shading'
+        ).selected_only = True
+
+        col.row(align=True).operator(
+            operator=ComputeAnimatedFaceShadows.bl_idname,
+            text='Generate Animated Face Shading'
+        )
+
         col.row(align=True).operator(
             operator=CreateMaterialOnly.bl_idname,
             text='Create Material Only'
@@ -164,3 +528,8 @@ class FaceShadePanel(bpy.types.Panel):
             operator=CreateNodeGroupOnly.bl_idname,
             text='Create Node Group Only'
         )
+
+        col.row(align=True).operator(
+            operator=ExportBakeBundle.bl_idname,
+            text='Export Bake Bundle'
+        )
@@ -0,0 +1,91 @@
+import math
+import os
+
+import numpy as np
+import numpy.typing as npt
+
+try:
+    import numba
+except ImportError:
+    # optional, the numpy versions in utils are used without it
+    numba = None
+
+# set to NUMPY to keep the numpy versions even when numba is installed
+KERNELS_VARIABLE = 'NPR_FACE_SHADER_KERNELS'
+
+
+def find_kernel_backend() -> str:
+    if numba is None or os.environ.get(KERNELS_VARIABLE, '').upper() == 'NUMPY':
+        return 'NUMPY'
+    return 'NUMBA'
+
+# read once per process, worker processes inherit the variable
+KERNEL_BACKEND = find_kernel_backend()
+
+
+# the loops below are only fast once compiled. they repeat the arithmetic of rasterize_shape and
+# find_value_inside_shape operation for operation, so both backends give the same values
+
+def trace_shape_rays(
+        x_positions: npt.NDArray[np.floating],
+        y_positions: npt.NDArray[np.floating],
+        center: npt.NDArray[np.floating],
+        segment_vectors: npt.NDArray[np.floating],
+        segment_offsets: npt.NDArray[np.floating],
+        t1_numerators: npt.NDArray[np.floating],
+        max_distance_squared: float,
+        one: float,
+        values: npt.NDArray[np.floating],
+        ) -> None:
+    # fills the (rows, columns) values with 1 / t1 of the first segment hit by each pixel's ray and leaves
+    # nan where there is none; one has the dtype of the pixels so that single precision stays single
+    for row in range(len(y_positions)):
+        ray_y = y_positions[row] - center[1]
+        for column in range(len(x_positions)):
+            ray_x = x_positions[column] - center[0]
+            values[row, column] = np.nan
+            if ray_x ** 2 + ray_y ** 2 > max_distance_squared:
+                continue
+            for segment in range(len(t1_numerators)):
+                denom = segment_vectors[segment, 0] * ray_y - ray_x * segment_vectors[segment, 1]
+                if denom == 0:
+                    continue
+                det = one / denom
+                t1 = det * t1_numerators[segment]
+                t2 = det * (ray_x * segment_offsets[segment, 1] - ray_y * segment_offsets[segment, 0])
+                if t1 > 1.0 and t2 >= 0.0 and t2 <= 1.0:
+                    values[row, column] = one / t1
+                    break
+
+def trace_shape_ray(
+        x_position: float,
+        y_position: float,
+        center: npt.NDArray[np.float64],
+        max_distance_squared: float,
+        points: npt.NDArray[np.float64],
+        ) -> float:
+    # find_value_inside_shape for a single pixel, nan instead of None
+    ray_x = x_position - center[0]
+    ray_y = y_position - center[1]
+    if ray_x * ray_x + ray_y * ray_y > max_distance_squared:
+        return math.nan
+    for i in range(1, len(points)):
+        segment_x = points[i, 0] - points[i - 1, 0]
+        segment_y = points[i, 1] - points[i - 1, 1]
+        denom = segment_x * ray_y - ray_x * segment_y
+        if denom == 0.0:
+            continue
+        det = 1.0 / denom
+        offset_x = points[i - 1, 0] - center[0]
+        offset_y = points[i - 1, 1] - center[1]
+        t1 = det * (segment_x * offset_y - segment_y * offset_x)
+        t2 = det * (ray_x * offset_y - ray_y * offset_x)
+        if t1 > 1.0 and t2 >= 0.0 and t2 <= 1.0:
+            return 1.0 / t1
+    return math.nan
+
+
+if KERNEL_BACKEND == 'NUMBA':
+    # compiled on first use; the cache keeps the machine code next to this file between sessions
+    trace_shape_rays = numba.njit(cache=True, nogil=True)(trace_shape_rays)
+    trace_shape_ray = numba.njit(cache=True, nogil=True)(trace_shape_ray)
@@ -65,6 +65,7 @@ def create_material(
         uv_map: str = '',
         sun_driver_obj: bpy.types.Object = None,
         head_driver_obj: bpy.types.Object = None,
+        packed: bool = False,
     ) -> None:
     new_material = bpy.data.materials.new(name=name)
     new_material.use_nodes = True
@@ -78,24 +79,39 @@ def create_material(
     uv_map_node = new_material.node_tree.nodes.new(type='ShaderNodeUVMap')
     uv_map_node.location = mathutils.Vector((-487.1404, 143.6472))
     uv_map_node.uv_map = uv_map
-    mapping_normal_node = new_material.node_tree.nodes.new(type='ShaderNodeMapping')
-    mapping_normal_node.location = mathutils.Vector((-239.7573, 424.1311))
-    mapping_flipped_node = new_material.node_tree.nodes.new(type='ShaderNodeMapping')
-    mapping_flipped_node.location = mathutils.Vector((-241.4846, 53.3045))
-    mapping_flipped_node.inputs[3].default_value = mathutils.Vector((-1.0, 1.0, 1.0))
-    image_normal_node = new_material.node_tree.nodes.new(type='ShaderNodeTexImage')
-    image_normal_node.location = mathutils.Vector((-18.7990, 337.3714))
-    image_normal_node.image = image
-    image_flipped_node = new_material.node_tree.nodes.new(type='ShaderNodeTexImage')
-    image_flipped_node.location = mathutils.Vector((-18.6186, -13.8533))
-    image_flipped_node.image = image
-    
-    new_material.node_tree.links.new(uv_map_node.outputs[0], mapping_normal_node.inputs[0])
-    new_material.node_tree.links.new(uv_map_node.outputs[0], mapping_flipped_node.inputs[0])
-    new_material.node_tree.links.new(mapping_normal_node.outputs[0], image_normal_node.inputs[0])
-    new_material.node_tree.links.new(mapping_flipped_node.outputs[0], image_flipped_node.inputs[0])
-    new_material.node_tree.links.new(image_normal_node.outputs[0], node_group.inputs[3])
-    new_material.node_tree.links.new(image_flipped_node.outputs[0], node_group.inputs[4])
+
+    if packed:
+        # the image holds the normal map in red and the mirrored one in green, so one fetch is enough
+        image_node = new_material.node_tree.nodes.new(type='ShaderNodeTexImage')
+        image_node.location = mathutils.Vector((-241.4846, 195.7629))
+        image_node.image = image
+        separate_node = new_material.node_tree.nodes.new(type='ShaderNodeSeparateColor')
+        separate_node.location = mathutils.Vector((-18.7990, 195.7629))
+
+        new_material.node_tree.links.new(uv_map_node.outputs[0], image_node.inputs[0])
+        new_material.node_tree.links.new(image_node.outputs[0], separate_node.inputs[0])
+        new_material.node_tree.links.new(separate_node.outputs[0], node_group.inputs[3])
+        new_material.node_tree.links.new(separate_node.outputs[1], node_group.inputs[4])
+    else:
+        mapping_normal_node = new_material.node_tree.nodes.new(type='ShaderNodeMapping')
+        mapping_normal_node.location = mathutils.Vector((-239.7573, 424.1311))
+        mapping_flipped_node = new_material.node_tree.nodes.new(type='ShaderNodeMapping')
+        mapping_flipped_node.location = mathutils.Vector((-241.4846, 53.3045))
+        mapping_flipped_node.inputs[3].default_value = mathutils.Vector((-1.0, 1.0, 1.0))
+        image_normal_node = new_material.node_tree.nodes.new(type='ShaderNodeTexImage')
+        image_normal_node.location = mathutils.Vector((-18.7990, 337.3714))
+        image_normal_node.image = image
+        image_flipped_node = new_material.node_tree.nodes.new(type='ShaderNodeTexImage')
+        image_flipped_node.location = mathutils.Vector((-18.6186, -13.8533))
+        image_flipped_node.image = image
+
+        new_material.node_tree.links.new(uv_map_node.outputs[0], mapping_normal_node.inputs[0])
+        new_material.node_tree.links.new(uv_map_node.outputs[0], mapping_flipped_node.inputs[0])
+        new_material.node_tree.links.new(mapping_normal_node.outputs[0], image_normal_node.inputs[0])
+        new_material.node_tree.links.new(mapping_flipped_node.outputs[0], image_flipped_node.inputs[0])
+        new_material.node_tree.links.new(image_normal_node.outputs[0], node_group.inputs[3])
+        new_material.node_tree.links.new(image_flipped_node.outputs[0], node_group.inputs[4])
+
     new_material.node_tree.links.new(node_group.outputs[0], material_output_node.inputs[0])
 
     if sun_driver_obj is not None:
@@ -0,0 +1,96 @@
+from typing import Any, Iterator, Optional
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+import json
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # not available on windows
+    resource = None
+
+from .workers import get_worker_busy_time, get_worker_count
+
+
+@dataclass
+class StageRecord:
+    name: str
+    wall_time: float = 0.0
+    cpu_time: float = 0.0
+    # highest traced allocation during the stage in bytes, None unless memory is traced
+    peak_memory: Optional[int] = None
+    # share of the pool's capacity spent working, None if the stage didn't use the pool
+    worker_utilization: Optional[float] = None
+    counts: dict[str, Any] = field(default_factory=dict)
+
+
+def get_max_resident_memory() -> Optional[int]:
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes everywhere but macos
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class BakeProfiler:
+    # collects a StageRecord per pipeline stage; tracing memory makes python heavy stages noticeably slower
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.stages: list[StageRecord] = []
+        self.counts: dict[str, Any] = {}
+        self.started = time.time()
+
+    @contextmanager
+    def stage(self, name: str, **counts: Any) -> Iterator[StageRecord]:
+        # counts can also be added to the yielded record while the stage runs
+        record = StageRecord(name=name, counts=dict(counts))
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        busy_start = get_worker_busy_time()
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.wall_time = time.perf_counter() - wall_start
+            record.cpu_time = time.process_time() - cpu_start
+            busy_time = get_worker_busy_time() - busy_start
+            if busy_time > 0.0 and record.wall_time > 0.0:
+                record.worker_utilization = busy_time / (record.wall_time * get_worker_count())
+            if self.trace_memory:
+                record.peak_memory = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+            self.stages.append(record)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'started': self.started,
+            'wall_time': sum(stage.wall_time for stage in self.stages),
+            'cpu_time': sum(stage.cpu_time for stage in self.stages),
+            'max_resident_memory': get_max_resident_memory(),
+            'counts': self.counts,
+            'stages': [asdict(stage) for stage in self.stages],
+        }
+
+    def to_json(self, **kwargs: Any) -> str:
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def write(self, path: str) -> None:
+        # one json object per line, so every bake can be appended to the same log
+        with open(path, 'a') as f:
+            f.write(self.to_json() + '\n')
+
+    def summary(self) -> str:
+        if not self.stages:
+            return 'No stages ran.'
+        slowest = max(self.stages, key=lambda stage: stage.wall_time)
+        total = sum(stage.wall_time for stage in self.stages)
+        return f'Baked in {total:.2f}s, slowest stage: {slowest.name} ({slowest.wall_time:.2f}s).'
@@ -0,0 +1,175 @@
+from dataclasses import dataclass
+import heapq
+
+import numpy as np
+import numpy.typing as npt
+
+# maximum number of faces stored in a single leaf
+LEAF_SIZE = 16
+
+@dataclass
+class FaceIndex:
+    # world space triangles and their centers
+    triangles: npt.NDArray[np.float64]
+    centroids: npt.NDArray[np.float64]
+    # face indices grouped so every node covers a contiguous range
+    order: npt.NDArray[np.intp]
+    node_starts: npt.NDArray[np.intp]
+    node_stops: npt.NDArray[np.intp]
+    # (left, right) per node, -1 for leaves
+    node_children: npt.NDArray[np.intp]
+    # (min, max) corners per node, over centroids and over whole triangles
+    centroid_bounds: npt.NDArray[np.float64]
+    triangle_bounds: npt.NDArray[np.float64]
+
+    def query(self, point: npt.NDArray[np.float64], exact: bool = False) -> int:
+        # exact=False matches get_closest_face (closest center),
+        # exact=True finds the triangle whose surface is closest
+        point = np.asarray(point, dtype=np.float64)
+        bounds = self.triangle_bounds if exact else self.centroid_bounds
+
+        best_face = -1
+        best_distance_squared = np.inf
+        heap = [(0.0, 0)]
+        while heap:
+            lower_bound, node = heapq.heappop(heap)
+            if lower_bound > best_distance_squared:
+                break
+            left, right = self.node_children[node]
+            if left < 0:
+                faces = self.order[self.node_starts[node]:self.node_stops[node]]
+                if exact:
+                    distances_squared = point_triangle_distance_squared(point, self.triangles[faces])
+                else:
+                    offsets = self.centroids[faces] - point
+                    distances_squared = np.einsum('ij,ij->i', offsets, offsets)
+                leaf_best = distances_squared.min()
+                # ties go to the lowest face index, like a linear scan would
+                leaf_face = faces[distances_squared == leaf_best].min()
+                if leaf_best < best_distance_squared or \
+                        (leaf_best == best_distance_squared and leaf_face < best_face):
+                    best_face = int(leaf_face)
+                    best_distance_squared = leaf_best
+                continue
+            for child in (left, right):
+                child_bound = box_distance_squared(point, bounds[child])
+                if child_bound <= best_distance_squared:
+                    heapq.heappush(heap, (child_bound, child))
+
+        return best_face
+
+    def query_many(self, points: npt.ArrayLike, exact: bool = False) -> npt.NDArray[np.intp]:
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        return np.array([self.query(point, exact) for point in points], dtype=np.intp)
+
+
+def build_face_index(triangles: npt.ArrayLike, leaf_size: int = LEAF_SIZE) -> FaceIndex:
+    triangles = np.asarray(triangles, dtype=np.float64).reshape(-1, 3, 3)
+    centroids = triangles.mean(axis=1)
+    order = np.arange(len(triangles))
+
+    starts: list[int] = []
+    stops: list[int] = []
+    children: list[list[int]] = []
+    # (start, stop, parent, side)
+    stack = [(0, len(order), -1, 0)]
+    while stack:
+        start, stop, parent, side = stack.pop()
+        node = len(starts)
+        starts.append(start)
+        stops.append(stop)
+        children.append([-1, -1])
+        if parent >= 0:
+            children[parent][side] = node
+        if stop - start <= leaf_size:
+            continue
+        # median split along the axis with the widest centroid spread
+        faces = order[start:stop]
+        axis = int(np.ptp(centroids[faces], axis=0).argmax())
+        middle = (stop - start) // 2
+        order[start:stop] = faces[np.argpartition(centroids[faces, axis], middle)]
+        stack.append((start + middle, stop, node, 1))
+        stack.append((start, start + middle, node, 0))
+
+    centroid_bounds = np.zeros((len(starts), 2, 3))
+    triangle_bounds = np.zeros((len(starts), 2, 3))
+    for node, (start, stop) in enumerate(zip(starts, stops)):
+        if stop == start:
+            continue
+        faces = order[start:stop]
+        centroid_bounds[node] = (centroids[faces].min(axis=0), centroids[faces].max(axis=0))
+        vertices = triangles[faces].reshape(-1, 3)
+        triangle_bounds[node] = (vertices.min(axis=0), vertices.max(axis=0))
+
+    return FaceIndex(
+        triangles=triangles,
+        centroids=centroids,
+        order=order,
+        node_starts=np.array(starts, dtype=np.intp),
+        node_stops=np.array(stops, dtype=np.intp),
+        node_children=np.array(children, dtype=np.intp).reshape(-1, 2),
+        centroid_bounds=centroid_bounds,
+        triangle_bounds=triangle_bounds,
+    )
+
+def box_distance_squared(point: npt.NDArray[np.float64], bounds: npt.NDArray[np.float64]) -> float:
+    offset = np.maximum(np.maximum(bounds[0] - point, point - bounds[1]), 0.0)
+    return float(offset.dot(offset))
+
+def point_triangle_distance_squared(
+        point: npt.NDArray[np.float64],
+        triangles: npt.NDArray[np.float64],
+        ) -> npt.NDArray[np.float64]:
+    # closest point by voronoi region of the triangle (Ericson, Real-Time Collision Detection 5.1.5)
+    a = triangles[:, 0]
+    b = triangles[:, 1]
+    c = triangles[:, 2]
+    ab = b - a
+    ac = c - a
+    ap = point - a
+    bp = point - b
+    cp = point - c
+
+    d1 = np.einsum('ij,ij->i', ab, ap)
+    d2 = np.einsum('ij,ij->i', ac, ap)
+    d3 = np.einsum('ij,ij->i', ab, bp)
+    d4 = np.einsum('ij,ij->i', ac, bp)
+    d5 = np.einsum('ij,ij->i', ab, cp)
+    d6 = np.einsum('ij,ij->i', ac, cp)
+    va = d3 * d6 - d5 * d4
+    vb = d5 * d2 - d1 * d6
+    vc = d1 * d4 - d3 * d2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        edge_ab = d1 / (d1 - d3)
+        edge_ac = d2 / (d2 - d6)
+        edge_bc = (d4 - d3) / ((d4 - d3) + (d5 - d6))
+        denom = 1.0 / (va + vb + vc)
+        closest = np.select(
+            [
+                ((d1 <= 0) & (d2 <= 0))[:, None],
+                ((d3 >= 0) & (d4 <= d3))[:, None],
+                ((vc <= 0) & (d1 >= 0) & (d3 <= 0))[:, None],
+                ((d6 >= 0) & (d5 <= d6))[:, None],
+                ((vb <= 0) & (d2 >= 0) & (d6 <= 0))[:, None],
+                ((va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0))[:, None],
+            ],
+            [
+                a,
+                b,
+                a + edge_ab[:, None] * ab,
+                c,
+                a + edge_ac[:, None] * ac,
+                b + edge_bc[:, None] * (c - b),
+            ],
+            default=a + ab * (vb * denom)[:, None] + ac * (vc * denom)[:, None],
+        )
+
+    offsets = closest - point
+    distances_squared = np.einsum('ij,ij->i', offsets, offsets)
+    # degenerate triangles fall back to their nearest vertex
+    degenerate = np.isnan(distances_squared)
+    if degenerate.any():
+        vertex_offsets = triangles[degenerate] - point
+        distances_squared[degenerate] = np.einsum('ijk,ijk->ij', vertex_offsets, vertex_offsets).min(axis=1)
+    return distances_squared
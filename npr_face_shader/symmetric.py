@@ -0,0 +1,135 @@
+from typing import Callable
+
+import numpy as np
+import numpy.typing as npt
+
+from .utils import *
+from .blur import blur_image, get_blur_reach
+
+# faces whose vertical lines mirror each other around the middle of the uv map, like the material's flipped
+# mapping assumes, have a base gradient with base(x) = 1 - base(1 - x). only the left half and a strip along
+# the right edge of it are computed and blurred, the rest is mirrored. shapes are blurred on their own over
+# their bounds and added on top, which gives the same image since the blur is linear
+
+# how far apart in texels a line and the mirror of its counterpart may be for the lines to count as mirrored
+SYMMETRY_TOLERANCE = 0.5
+# share of a full bake's pixels above which the separate shape regions make mirroring slower than a full bake
+MAX_MIRRORED_SHARE = 0.7
+
+
+def get_symmetry_error(intersection_points: npt.NDArray[np.floating], width: int) -> float:
+    # largest distance in texels between a line and the mirror of its counterpart over every row;
+    # lines are sorted left to right, so the counterpart of the first line is the last one
+    if len(intersection_points) == 0:
+        return 0.0
+    return float(np.abs(intersection_points + intersection_points[::-1] - 1.0).max()) * width
+
+def symmetrize_intersections(intersection_points: npt.NDArray[np.floating]) -> npt.NDArray[np.floating]:
+    # moves every line halfway to the mirror of its counterpart, so both sides use the same lines
+    return (intersection_points + (1.0 - intersection_points[::-1])) / 2.0
+
+def get_mirror_shift(blur_size: int, blur_type: str) -> int:
+    # even sized windows reach one pixel further left than right, so their mirror lands one column over;
+    # the boxes of the fast gaussian are always odd
+    if blur_size <= 1 or blur_type == 'ITERATED_BOX':
+        return 0
+    return 1 - blur_size % 2
+
+def get_mirrored_columns(width: int, blur_size: int, blur_type: str) -> tuple[int, int, int, int]:
+    # [start, stop) of the columns mirrored from the left half, the end of the blurred left columns they come
+    # from and the end of the left columns whose base is computed. pixel x lies at x / width, so column x
+    # mirrors column width - x; columns whose blur reaches the right edge are blurred against that edge
+    reach = get_blur_reach(blur_size, blur_type)
+    start = width // 2 + 1
+    stop = width - reach
+    if stop <= start:
+        # nothing to mirror, every column is computed
+        return width, width, width, width
+    left_stop = max(width - start + 1 + get_mirror_shift(blur_size, blur_type), start)
+    # the base of the right edge strip is mirrored from the left columns as well
+    base_stop = min(max(left_stop + reach, width - (stop - reach) + 1), width)
+    return start, stop, left_stop, base_stop
+
+def find_shape_regions(coverages: list[ShapeCoverage]) -> list[tuple[Tile, list[int]]]:
+    # bounds of every group of overlapping coverages with the indices of its coverages in blending order;
+    # blending only mixes overlapping shapes, so the groups can be composited and blurred separately
+    groups: list[tuple[Tile, list[int]]] = []
+    for index, coverage in enumerate(coverages):
+        height, width = coverage.values.shape
+        if width == 0 or height == 0:
+            continue
+        bounds = Tile(coverage.x_start, coverage.y_start, coverage.x_start + width, coverage.y_start + height)
+        members = [index]
+        merged = True
+        while merged:
+            merged = False
+            for group_index, (group_bounds, group_members) in enumerate(groups):
+                if group_bounds.x_start < bounds.x_stop and bounds.x_start < group_bounds.x_stop \
+                        and group_bounds.y_start < bounds.y_stop and bounds.y_start < group_bounds.y_stop:
+                    bounds = Tile(
+                        min(bounds.x_start, group_bounds.x_start), min(bounds.y_start, group_bounds.y_start),
+                        max(bounds.x_stop, group_bounds.x_stop), max(bounds.y_stop, group_bounds.y_stop))
+                    members += group_members
+                    del groups[group_index]
+                    merged = True
+                    break
+        groups.append((bounds, sorted(members)))
+    return groups
+
+def count_symmetric_pixels(width: int, height: int, blur_size: int, blur_type: str, regions: list[Tile]) -> int:
+    # pixels blurred by render_symmetric, to compare with the width * height of a full bake
+    reach = get_blur_reach(blur_size, blur_type)
+    _, stop, _, base_stop = get_mirrored_columns(width, blur_size, blur_type)
+    columns = base_stop + width - max(stop - reach, 0) if stop < width else base_stop
+    expanded = [region.expanded(reach, width, height) for region in regions]
+    return columns * height + sum(region.width * region.height for region in expanded)
+
+def render_symmetric(
+        width: int,
+        height: int,
+        intersection_points: npt.NDArray[np.floating],
+        coverages: list[ShapeCoverage],
+        remaps: list[Callable[[float], float]],
+        blur_size: int,
+        blur_type: str,
+        blur_edge: str,
+        dtype: npt.DTypeLike = np.float32,
+        ) -> npt.NDArray[np.floating]:
+    # the blurred (height, width) map of mirrored lines; coverages are blended in order with their remaps
+    reach = get_blur_reach(blur_size, blur_type)
+    start, stop, left_stop, base_stop = get_mirrored_columns(width, blur_size, blur_type)
+    shift = get_mirror_shift(blur_size, blur_type)
+
+    # the base reaches past left_stop by the blur's reach, which makes the blurred left columns exact
+    base = calculate_base_pixels(width, height, intersection_points, dtype, tile=Tile(0, 0, base_stop, height))
+    base = base.reshape(height, base_stop)
+    left = blur_image(base, blur_size, blur_type, blur_edge)[:, :left_stop]
+
+    image_pixels = np.empty((height, width), dtype=dtype)
+    image_pixels[:, :start] = left[:, :start]
+    if stop < width:
+        # base(x) = 1 - base(width - x) for every column but the first
+        strip_start = stop - reach
+        strip = 1.0 - base[:, 1:width - strip_start + 1][:, ::-1]
+        image_pixels[:, stop:] = blur_image(strip, blur_size, blur_type, blur_edge)[:, reach:]
+    if start < stop:
+        # blurring 1 - base gives the blur of a white image minus the blurred base, which is 1 unless
+        # zero edges darken the top and bottom rows
+        white = blur_image(np.ones((height, 2 * reach + 1), dtype=dtype), blur_size, blur_type, blur_edge)
+        mirrored = left[:, width - stop + 1 + shift:width - start + 1 + shift][:, ::-1]
+        image_pixels[:, start:stop] = white[:, reach, None] - mirrored
+
+    for bounds, members in find_shape_regions(coverages):
+        # what the shapes add to the base, blurred on its own
+        bounds_base = calculate_base_pixels(width, height, intersection_points, dtype, tile=bounds)
+        composite = bounds_base.copy()
+        for index in members:
+            blend_coverages(composite, [coverages[index]], remaps[index], bounds)
+        region = bounds.expanded(reach, width, height)
+        difference = np.zeros((region.height, region.width), dtype=dtype)
+        difference[bounds.y_start - region.y_start:bounds.y_stop - region.y_start,
+                   bounds.x_start - region.x_start:bounds.x_stop - region.x_start] = \
+            (composite - bounds_base).reshape(bounds.height, bounds.width)
+        image_pixels[region.slices()] += blur_image(difference, blur_size, blur_type, blur_edge)
+
+    return image_pixels
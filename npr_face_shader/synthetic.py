@@ -0,0 +1,80 @@
+from dataclasses import dataclass
+
+import numpy as np
+import numpy.typing as npt
+
+from .utils import TriangleMesh
+from .bake import StrokeGroup, BakeInputs
+
+# generated test faces for benchmarking, no blender needed
+
+
+@dataclass
+class SyntheticFace:
+    # grid cells per side of the face, the mesh has 2 * mesh_resolution ** 2 triangles
+    mesh_resolution: int = 64
+    line_count: int = 8
+    line_points: int = 200
+    shadow_count: int = 3
+    highlight_count: int = 2
+    shape_points: int = 200
+    # how far the middle of the face bulges towards the viewer
+    depth: float = 0.3
+    seed: int = 0
+
+
+def face_surface(u: npt.NDArray[np.float64], v: npt.NDArray[np.float64], depth: float) -> npt.NDArray[np.float64]:
+    # point on the face for uv coordinates, the uv map is a straight projection from the front
+    bulge = (1.0 - (2.0 * u - 1.0) ** 2) * (1.0 - (2.0 * v - 1.0) ** 2)
+    return np.stack([u - 0.5, -depth * bulge, v - 0.5], axis=-1)
+
+def build_face_mesh(face: SyntheticFace) -> TriangleMesh:
+    steps = np.linspace(0.0, 1.0, face.mesh_resolution + 1)
+    u, v = np.meshgrid(steps, steps)
+    uvs = np.stack([u, v], axis=-1).reshape(-1, 2)
+    positions = face_surface(uvs[:, 0], uvs[:, 1], face.depth)
+
+    row = face.mesh_resolution + 1
+    corners = (np.arange(face.mesh_resolution)[:, None] * row + np.arange(face.mesh_resolution)[None, :]).reshape(-1)
+    triangles = np.concatenate([
+        np.stack([corners, corners + 1, corners + row], axis=1),
+        np.stack([corners + 1, corners + row + 1, corners + row], axis=1),
+    ])
+    return TriangleMesh(
+        positions=positions[triangles].astype(np.float32),
+        uvs=uvs[triangles].astype(np.float32),
+    )
+
+def build_face_lines(face: SyntheticFace, generator: np.random.Generator) -> list[npt.NDArray[np.float32]]:
+    v = np.linspace(0.01, 0.99, face.line_points)
+    lines = []
+    for x in np.linspace(0.0, 1.0, face.line_count + 2)[1:-1]:
+        # slightly wavy, like hand drawn lines
+        wave = 0.3 / (face.line_count + 1) * np.sin(generator.uniform(3.0, 9.0) * v + generator.uniform(0.0, 2.0 * np.pi))
+        lines.append(face_surface(x + wave, v, face.depth).astype(np.float32))
+    return lines
+
+def build_face_shapes(face: SyntheticFace, count: int, generator: np.random.Generator) -> list[npt.NDArray[np.float32]]:
+    shapes = []
+    for _ in range(count):
+        center = generator.uniform(0.2, 0.8, size=2)
+        radius = generator.uniform(0.05, 0.15)
+        lobes = generator.integers(3, 7)
+        # strokes run a bit past their start, so closing them finds the overlap like it would on drawn shapes
+        angles = np.linspace(0.1, 2.0 * np.pi + 0.3, face.shape_points)
+        distance = radius * (1.0 + 0.25 * np.sin(lobes * angles))
+        u = np.clip(center[0] + distance * np.cos(angles), 0.0, 1.0)
+        v = np.clip(center[1] + distance * np.sin(angles), 0.0, 1.0)
+        shapes.append(face_surface(u, v, face.depth).astype(np.float32))
+    return shapes
+
+def build_synthetic_inputs(face: SyntheticFace) -> BakeInputs:
+    generator = np.random.default_rng(face.seed)
+    identity = np.eye(3)
+    return BakeInputs(
+        mesh=build_face_mesh(face),
+        mesh_matrix_world=identity,
+        lines=StrokeGroup(build_face_lines(face, generator), identity),
+        shadow_shapes=StrokeGroup(build_face_shapes(face, face.shadow_count, generator), identity),
+        highlight_shapes=StrokeGroup(build_face_shapes(face, face.highlight_count, generator), identity),
+    )
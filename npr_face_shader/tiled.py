@@ -0,0 +1,94 @@
+from typing import Callable, Optional
+import os
+
+import numpy as np
+import numpy.typing as npt
+
+from .utils import *
+from .blur import blur_image
+
+DEFAULT_TILE_SIZE = 1024
+
+
+def split_into_tiles(width: int, height: int, tile_size: int) -> list[Tile]:
+    return [
+        Tile(x_start, y_start, min(x_start + tile_size, width), min(y_start + tile_size, height))
+        for y_start in range(0, height, tile_size)
+        for x_start in range(0, width, tile_size)
+    ]
+
+def render_composite_tile(
+        width: int,
+        height: int,
+        tile: Tile,
+        intersection_points: npt.NDArray[np.float64],
+        shadow_shapes: list[list[npt.NDArray[np.float64]]],
+        highlight_shapes: list[list[npt.NDArray[np.float64]]],
+        dtype: npt.DTypeLike = np.float32,
+        shadow_centers: Optional[list[Optional[npt.NDArray[np.float64]]]] = None,
+        highlight_centers: Optional[list[Optional[npt.NDArray[np.float64]]]] = None,
+        ) -> npt.NDArray[np.floating]:
+    # base gradient with every shape blended in, before blurring; shapes without a center use their mean
+    tile_pixels = calculate_base_pixels(width, height, intersection_points, dtype, tile=tile)
+    shadow_centers = shadow_centers or [None] * len(shadow_shapes)
+    highlight_centers = highlight_centers or [None] * len(highlight_shapes)
+    # shapes are rasterized as they are blended, so only one coverage is held at a time
+    blend_coverages(
+        tile_pixels,
+        (rasterize_shape(width, height, shape, dtype, tile=tile, center=center)
+         for shape, center in zip(shadow_shapes, shadow_centers)),
+        remap_shadow_value, tile)
+    blend_coverages(
+        tile_pixels,
+        (rasterize_shape(width, height, shape, dtype, tile=tile, center=center)
+         for shape, center in zip(highlight_shapes, highlight_centers)),
+        remap_highlight_value, tile)
+    return tile_pixels.reshape(tile.height, tile.width)
+
+def render_tiled(
+        width: int,
+        height: int,
+        intersection_points: npt.NDArray[np.float64],
+        shadow_shapes: list[list[npt.NDArray[np.float64]]],
+        highlight_shapes: list[list[npt.NDArray[np.float64]]],
+        blur_size: int,
+        blur_type: str,
+        blur_edge: str,
+        channels: int,
+        directory: str,
+        tile_size: int = DEFAULT_TILE_SIZE,
+        dtype: npt.DTypeLike = np.float32,
+        progress: Optional[Callable[[float], None]] = None,
+        shadow_centers: Optional[list[Optional[npt.NDArray[np.float64]]]] = None,
+        highlight_centers: Optional[list[Optional[npt.NDArray[np.float64]]]] = None,
+        ) -> np.memmap:
+    # renders tile by tile into files in directory and returns the finished pixel buffer
+    # (blender layout, channels per pixel) as a memmap, so only about one tile is ever in memory;
+    # progress gets the finished share of the work after every tile
+    tiles = split_into_tiles(width, height, tile_size)
+    steps = 2 * len(tiles)
+
+    composite = np.memmap(os.path.join(directory, 'composite.raw'), dtype=dtype, mode='w+', shape=(height, width))
+    for i, tile in enumerate(tiles):
+        composite[tile.slices()] = render_composite_tile(
+            width, height, tile, intersection_points, shadow_shapes, highlight_shapes, dtype,
+            shadow_centers, highlight_centers)
+        if progress is not None:
+            progress((i + 1) / steps)
+    composite.flush()
+
+    # every blur type reaches at most blur_size pixels, so that much overlap makes tile seams exact
+    output = np.memmap(os.path.join(directory, 'output.f32'), dtype=np.float32, mode='w+', shape=(height * width * channels,))
+    output_pixels = output.reshape(height, width, channels)
+    for i, tile in enumerate(tiles):
+        region = tile.expanded(blur_size, width, height)
+        blurred = blur_image(np.array(composite[region.slices()]), blur_size, blur_type, blur_edge)
+        inner = blurred[tile.y_start - region.y_start:tile.y_stop - region.y_start,
+                        tile.x_start - region.x_start:tile.x_stop - region.x_start]
+        output_pixels[tile.slices()] = build_image_buffer(inner.reshape(-1), channels).reshape(tile.height, tile.width, channels)
+        if progress is not None:
+            progress((len(tiles) + i + 1) / steps)
+    output.flush()
+
+    del composite
+    return output
@@ -1,10 +1,25 @@
 from typing import Optional, Any, Callable
-from collections.abc import Iterable
+from collections.abc import Iterable, Iterator
 from dataclasses import dataclass
 
 import numpy as np
 import numpy.typing as npt
 
+from .spatial import FaceIndex, build_face_index
+from .kernels import KERNEL_BACKEND, trace_shape_rays, trace_shape_ray
+from .workers import attach_fields
+
+# working dtype of the pixel pipeline for each precision setting
+PRECISION_DTYPES = {
+    'SINGLE': np.float32,
+    'DOUBLE': np.float64,
+}
+
+# segments whose crossings are looked for first while closing shapes, doubled for every following chunk
+FIRST_SEGMENT_CHUNK = 64
+# upper bound on segment pairs tested at once while looking for shape intersections
+SEGMENT_PAIRS_PER_BATCH = 1 << 18
+
 @dataclass
 class BasePixelCalculator:
     width: int
@@ -41,9 +56,16 @@ class ShapePixelCalculator:
     shape_max_distance_squared: float
     shape_points: list[npt.NDArray[np.float64]]
 
+    def __post_init__(self):
+        self.points_array = np.asarray(self.shape_points, dtype=np.float64)
+
     def __call__(self, index: int) -> Optional[float]:
         x_index = index % self.width
         y_index = index // self.width
+        if KERNEL_BACKEND == 'NUMBA':
+            ratio = trace_shape_ray(x_index / self.width, y_index / self.height, self.shape_center,
+                                    self.shape_max_distance_squared, self.points_array)
+            return None if np.isnan(ratio) else ratio
         position = np.array([x_index / self.width, y_index / self.height])
         ratio = find_value_inside_shape(position, self.shape_center, self.shape_max_distance_squared, self.shape_points)
         if not ratio:
@@ -52,23 +74,73 @@ class ShapePixelCalculator:
 
 
 @dataclass
-class Simple3DFace:
-    uvs: list[npt.NDArray[np.float64]]
-    vertices: list[npt.NDArray[np.float64]]
+class Tile:
+    # pixel region [start, stop) of an image
+    x_start: int
+    y_start: int
+    x_stop: int
+    y_stop: int
+
+    @property
+    def width(self) -> int:
+        return self.x_stop - self.x_start
+
+    @property
+    def height(self) -> int:
+        return self.y_stop - self.y_start
+
+    def slices(self) -> tuple[slice, slice]:
+        return (slice(self.y_start, self.y_stop), slice(self.x_start, self.x_stop))
+
+    def expanded(self, margin: int, width: int, height: int) -> 'Tile':
+        return Tile(
+            x_start=max(self.x_start - margin, 0),
+            y_start=max(self.y_start - margin, 0),
+            x_stop=min(self.x_stop + margin, width),
+            y_stop=min(self.y_stop + margin, height),
+        )
+
+
+@dataclass
+class ShapeCoverage:
+    # pixel bounds of the rasterized region, values are nan where the shape does not cover
+    x_start: int
+    y_start: int
+    values: npt.NDArray[np.floating]
+
+
+@dataclass
+class TriangleMesh:
+    # (F, 3, 3) local vertex positions and (F, 3, 2) uvs, one row per triangle
+    positions: npt.NDArray[np.float32]
+    uvs: npt.NDArray[np.float32]
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def world_positions(self, matrix_world: npt.NDArray[np.float64]) -> npt.NDArray[np.float64]:
+        return self.positions.astype(np.float64) @ np.asarray(matrix_world).T
 
 
 @dataclass
 class UVProjector:
-    triangulated_mesh: list[Simple3DFace]
+    triangulated_mesh: TriangleMesh
     mesh_matrix_world: npt.NDArray[np.float64]
     points_matrix_world: npt.NDArray[np.float64]
+    face_index: Optional[FaceIndex] = None
+    exact: bool = False
+    dtype: npt.DTypeLike = np.float64
 
     def __call__(self, points: list[npt.NDArray[np.float64]]) -> Any:
+        # mesh and index may have been moved to shared memory by workers.map_shared
         return project_points_to_uv(
-            triangulated_mesh=self.triangulated_mesh,
+            triangulated_mesh=attach_fields(self.triangulated_mesh),
             mesh_matrix_world=self.mesh_matrix_world,
             points=points,
             points_matrix_world=self.points_matrix_world,
+            face_index=attach_fields(self.face_index),
+            exact=self.exact,
+            dtype=self.dtype,
         )
 
 
@@ -85,11 +157,12 @@ def barycentric_coordinates(
     v1 = c - a
     v2 = p - a
     
-    d00 = np.dot(v0, v0)
-    d01 = np.dot(v0, v1)
-    d11 = np.dot(v1, v1)
-    d20 = np.dot(v2, v0)
-    d21 = np.dot(v2, v1)
+    # works on single points as well as (N, 3) batches
+    d00 = (v0 * v0).sum(axis=-1)
+    d01 = (v0 * v1).sum(axis=-1)
+    d11 = (v1 * v1).sum(axis=-1)
+    d20 = (v2 * v0).sum(axis=-1)
+    d21 = (v2 * v1).sum(axis=-1)
     
     denom = d00 * d11 - d01 * d01
     v = (d11 * d20 - d01 * d21) / denom
@@ -106,27 +179,21 @@ def interpolate_point_barycentric(
         val_b: npt.NDArray[np.float64],
         val_c: npt.NDArray[np.float64],
         ) -> npt.NDArray[np.float64]:
+    u, v, w = (np.asarray(weight)[..., None] for weight in (u, v, w))
     interpolated_value = u * val_a + v * val_b + w * val_c
     return interpolated_value
 
-def get_closest_face(pos: npt.NDArray[np.float64], target_mesh: list[Simple3DFace], matrix_world: npt.NDArray[np.float64]) -> Optional[Simple3DFace]:
-    closest_face = None
-    closest_face_distance_squared = None
-    
-    for face in target_mesh:
-        face_center = np.array([0.0, 0.0, 0.0])
-        for vertex in face.vertices:
-            vertex_loc = matrix_world @ np.array(vertex)
-            face_center += vertex_loc
-        
-        face_center /= len(face.vertices)
-        distance = face_center - pos
-        distance_squared = distance.dot(distance)
-        if not closest_face or distance_squared < closest_face_distance_squared:
-            closest_face = face
-            closest_face_distance_squared = distance_squared
+def get_closest_face(pos: npt.NDArray[np.float64], target_mesh: TriangleMesh, matrix_world: npt.NDArray[np.float64]) -> Optional[int]:
+    if len(target_mesh) == 0:
+        return None
     
-    return closest_face
+    face_centers = target_mesh.world_positions(matrix_world).mean(axis=1)
+    distances = face_centers - pos
+    return int(np.einsum('ij,ij->i', distances, distances).argmin())
+
+def build_mesh_face_index(target_mesh: TriangleMesh, matrix_world: npt.NDArray[np.float64]) -> FaceIndex:
+    # world space positions are only needed for the lookup, so they are computed once here
+    return build_face_index(target_mesh.world_positions(matrix_world))
 
 def get_furthest_vertex_distance(pos: npt.NDArray[np.float64], vertices: Iterable[npt.NDArray[np.float64]]) -> float:
     furthest_vertex_distance_squared = None
@@ -147,6 +214,72 @@ def get_surrounding_values(value: Any, options: Iterable[Any], key: Callable):
         previous_option = option
     return (previous_option, None)
 
+def find_row_intersections(
+        lines: list[list[npt.NDArray[np.float64]]],
+        height: int,
+        dtype: npt.DTypeLike = np.float64,
+        ) -> npt.NDArray[np.floating]:
+    # (lines, height) matrix of the x value where each line crosses each pixel row,
+    # rows past either end of a line take the x of its first or last point; lines without points are left out
+    lines = [line for line in lines if len(line) > 0]
+    rows = (np.arange(height) / height).astype(dtype)
+    intersection_points = np.empty((len(lines), height), dtype=dtype)
+    for line_index, line in enumerate(lines):
+        points = np.asarray(line, dtype=dtype).reshape(-1, 2)
+        # stable so ties resolve the same way as get_surrounding_values
+        points = points[np.argsort(points[:, 1], kind='stable')]
+        x_values = points[:, 0]
+        y_values = points[:, 1]
+
+        after_index = np.searchsorted(y_values, rows, side='right')
+        before_index = np.maximum(after_index - 1, 0)
+        after_index_clamped = np.minimum(after_index, len(points) - 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            d = (rows - y_values[before_index]) / (y_values[after_index_clamped] - y_values[before_index])
+            interpolated = x_values[after_index_clamped] * d + x_values[before_index] * (1 - d)
+
+        intersection_points[line_index] = np.where(
+            after_index == 0, x_values[0],
+            np.where(after_index == len(points), x_values[-1], interpolated))
+    return intersection_points
+
+def calculate_base_pixels(
+        width: int,
+        height: int,
+        intersection_points: npt.ArrayLike,
+        dtype: npt.DTypeLike = np.float32,
+        tile: Optional[Tile] = None,
+        ) -> npt.NDArray[np.floating]:
+    # whole-image version of BasePixelCalculator, returns a flat buffer covering the tile (or whole image),
+    # computed in dtype
+    if tile is None:
+        tile = Tile(0, 0, width, height)
+    intersection_points = np.asarray(intersection_points, dtype=dtype).reshape(-1, height)
+    line_count = intersection_points.shape[0]
+    image_pixels = np.zeros((tile.height, tile.width), dtype=dtype)
+    if line_count == 0:
+        return image_pixels.reshape(tile.width * tile.height)
+
+    x_positions = (np.arange(tile.x_start, tile.x_stop) / width).astype(dtype)
+    # stable sort so ties resolve the same way as get_surrounding_values
+    order = np.argsort(intersection_points, axis=0, kind='stable')
+    sorted_points = np.take_along_axis(intersection_points, order, axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for row_index, y_index in enumerate(range(tile.y_start, tile.y_stop)):
+            row = sorted_points[:, y_index]
+            # number of lines at or to the left of each pixel
+            right_index = np.searchsorted(row, x_positions, side='right')
+            left_index = np.maximum(right_index - 1, 0)
+            left_x = row[left_index]
+            right_x = np.where(right_index < line_count, row[np.minimum(right_index, line_count - 1)], 1.0)
+            offset = order[left_index, y_index] + 1
+            between = (offset + (x_positions - left_x) / (right_x - left_x)) / (line_count + 1)
+            before_first = (x_positions / row[0]) / (line_count + 1)
+            image_pixels[row_index] = np.where(right_index > 0, between, before_first)
+
+    return image_pixels.reshape(tile.width * tile.height)
+
 def get_line_x_from_y(y: float, p1: npt.NDArray[np.float64], p2: npt.NDArray[np.float64]) -> float:
     d = (y - p1[1]) / (p2[1] - p1[1])
     return p2[0] * d + p1[0] * (1 - d)
@@ -157,42 +290,121 @@ def set_pixel(image_pixels: npt.NDArray[np.float64], index: int, color: float) -
 def get_pixel(image_pixels: npt.NDArray[np.float64], index: int) -> float:
     return image_pixels[index]
 
-def set_pixel_blended(image_pixels: npt.NDArray[np.float64], index: int, color: float) -> None:
-    image_pixels[index] = blend_overlay(image_pixels[index], color)
-    
-def blend_overlay(value_a: float, value_b: float) -> float:
-    return (2 * value_a * value_b) if value_b else (1 - 2 * (1 - value_a) * (1 - value_b))
+def remap_shadow_value(value: float) -> float:
+    return value ** 2 / 2.0
+
+def remap_highlight_value(value: float) -> float:
+    return (1 - value ** 2) / 2.0 + 0.5
+
+def blend_coverages(
+        image_pixels: npt.NDArray[np.floating],
+        coverages: Iterable[ShapeCoverage],
+        remap: Callable[[float], float],
+        tile: Tile,
+        ) -> None:
+    # image_pixels is the flat buffer of tile, coverages are in whole-image pixels;
+    # shapes are blended one after another like before, each only over its bounding box
+    tile_pixels = image_pixels.reshape(tile.height, tile.width)
+    for coverage in coverages:
+        height, width = coverage.values.shape
+        x_start = max(coverage.x_start, tile.x_start)
+        y_start = max(coverage.y_start, tile.y_start)
+        x_stop = min(coverage.x_start + width, tile.x_stop)
+        y_stop = min(coverage.y_start + height, tile.y_stop)
+        if x_stop <= x_start or y_stop <= y_start:
+            continue
+        values = coverage.values[
+            y_start - coverage.y_start:y_stop - coverage.y_start,
+            x_start - coverage.x_start:x_stop - coverage.x_start]
+        region = tile_pixels[y_start - tile.y_start:y_stop - tile.y_start, x_start - tile.x_start:x_stop - tile.x_start]
+        covered = ~np.isnan(values)
+        # remapped in double precision like the python floats the remaps were written for
+        colors = remap(values[covered].astype(np.float64)).astype(image_pixels.dtype)
+        region[covered] = blend_overlay_array(region[covered], colors)
+
+def blend_overlay_array(values_a: npt.NDArray[np.floating], values_b: npt.NDArray[np.floating]) -> npt.NDArray[np.floating]:
+    return np.where(values_b != 0, 2 * values_a * values_b, 1 - 2 * (1 - values_a) * (1 - values_b))
 
 def project_points_to_uv(
-        triangulated_mesh: list[Simple3DFace],
+        triangulated_mesh: TriangleMesh,
         mesh_matrix_world: npt.NDArray[np.float64],
         points: Iterable[npt.NDArray[np.float64]],
         points_matrix_world: npt.NDArray[np.float64],
-        ) -> list[npt.NDArray[np.float64]]:
+        face_index: Optional[FaceIndex] = None,
+        exact: bool = False,
+        dtype: npt.DTypeLike = np.float64,
+        ) -> list[npt.NDArray[np.floating]]:
     
-    projected: list[npt.NDArray[np.float64]] = []
+    if face_index is None:
+        face_index = build_mesh_face_index(triangulated_mesh, mesh_matrix_world)
 
-    for initial_point in points:
-        initial_point_pos = points_matrix_world @ initial_point
-        closest_face = get_closest_face(initial_point_pos, triangulated_mesh, mesh_matrix_world)
-        
-        # Barycentric conversion then interpolation.
-        triangle_a = closest_face.vertices[0]
-        triangle_b = closest_face.vertices[1]
-        triangle_c = closest_face.vertices[2]
-        
-        value_a = closest_face.uvs[0]
-        value_b = closest_face.uvs[1]
-        value_c = closest_face.uvs[2]
-        
-        input_point = np.array(initial_point_pos)
-        
-        u, v, w = barycentric_coordinates(input_point, triangle_a, triangle_b, triangle_c)
-        final_uv = interpolate_point_barycentric(u, v, w, value_a, value_b, value_c)
-        
-        projected.append(final_uv)
+    points_pos = np.asarray(list(points), dtype=np.float64).reshape(-1, 3) @ np.asarray(points_matrix_world).T
+    closest_faces = face_index.query_many(points_pos, exact)
+    
+    # Barycentric conversion then interpolation, for all points at once.
+    triangles = triangulated_mesh.positions[closest_faces].astype(dtype)
+    values = triangulated_mesh.uvs[closest_faces].astype(dtype)
+    
+    u, v, w = barycentric_coordinates(points_pos.astype(dtype), triangles[:, 0], triangles[:, 1], triangles[:, 2])
+    final_uvs = interpolate_point_barycentric(u, v, w, values[:, 0], values[:, 1], values[:, 2])
     
-    return projected
+    return list(final_uvs)
+
+def get_uv_density(triangulated_mesh: TriangleMesh, matrix_world: npt.NDArray[np.float64]) -> float:
+    # average world units per uv unit, from the total area of the triangles in both spaces
+    positions = triangulated_mesh.positions.astype(np.float64) @ np.asarray(matrix_world).T
+    uvs = triangulated_mesh.uvs.astype(np.float64)
+    world_area = np.linalg.norm(
+        np.cross(positions[:, 1] - positions[:, 0], positions[:, 2] - positions[:, 0]), axis=1).sum()
+    uv_edges_a = uvs[:, 1] - uvs[:, 0]
+    uv_edges_b = uvs[:, 2] - uvs[:, 0]
+    uv_area = np.abs(uv_edges_a[:, 0] * uv_edges_b[:, 1] - uv_edges_a[:, 1] * uv_edges_b[:, 0]).sum()
+    return float(np.sqrt(world_area / uv_area)) if uv_area > 0.0 else 0.0
+
+def simplify_stroke(
+        points: npt.NDArray[np.floating],
+        tolerance: float,
+        ) -> tuple[npt.NDArray[np.floating], npt.NDArray[np.float64]]:
+    # ramer-douglas-peucker: keeps the fewest points so no dropped point is further than tolerance
+    # from the simplified stroke; every span is split at once, so there is one pass per level of the recursion.
+    # also returns how many drawn points each span between kept points stands for, as a (spans, 2) array
+    # shared between its start and end by where the drawn points lie along it, so means over the stroke are kept
+    points = np.asarray(points)
+    if len(points) < 3 or tolerance <= 0.0:
+        span_weights = np.zeros((max(len(points) - 1, 0), 2))
+        span_weights[:, 0] = 1.0
+        if len(span_weights):
+            span_weights[-1, 1] = 1.0
+        return points, span_weights
+    positions = points.astype(np.float64)
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    while True:
+        kept = np.flatnonzero(keep)
+        # every point lies in the span starting at the last kept point before it
+        spans = np.minimum(np.cumsum(keep) - 1, len(kept) - 2)
+        starts = positions[kept[spans]]
+        directions = positions[kept[spans + 1]] - starts
+        offsets = positions - starts
+        lengths_squared = (directions ** 2).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # distance to the span's segment, or to its start if both ends are the same point
+            t = np.where(lengths_squared > 0.0, (offsets * directions).sum(axis=1) / lengths_squared, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        distances = np.linalg.norm(offsets - t[:, None] * directions, axis=1)
+        distances[keep] = 0.0
+
+        furthest = np.maximum.reduceat(distances, kept[:-1])
+        split = np.flatnonzero((distances > tolerance) & (distances == furthest[spans]))
+        if len(split) == 0:
+            span_weights = np.stack([
+                np.bincount(spans, 1.0 - t, len(kept) - 1),
+                np.bincount(spans, t, len(kept) - 1),
+            ], axis=1)
+            return points[keep], span_weights
+        # the first of equally far points, like the recursive version
+        _, first = np.unique(spans[split], return_index=True)
+        keep[split[first]] = True
 
 # TODO: perchance use numpy matrices to make this kewler
 def get_intersection_point(
@@ -216,36 +428,169 @@ def get_intersection_point(
     
     return (t1, t2, m1 * t1 + b1)
 
+def expand_ranges(
+        owners: npt.NDArray[np.int64],
+        range_starts: npt.NDArray[np.int64],
+        range_stops: npt.NDArray[np.int64],
+        ) -> Iterator[tuple[npt.NDArray[np.int64], npt.NDArray[np.int64]]]:
+    # every owner paired with each position in its [start, stop) range, in batches of whole owners
+    # holding about SEGMENT_PAIRS_PER_BATCH pairs
+    counts = np.maximum(range_stops - range_starts, 0)
+    totals = np.cumsum(counts)
+    first = 0
+    while first < len(owners):
+        done = totals[first - 1] if first > 0 else 0
+        stop = max(int(np.searchsorted(totals, done + SEGMENT_PAIRS_PER_BATCH, side='right')), first + 1)
+        batch_counts = counts[first:stop]
+        offsets = np.arange(batch_counts.sum()) - np.repeat(np.cumsum(batch_counts) - batch_counts, batch_counts)
+        yield np.repeat(owners[first:stop], batch_counts), np.repeat(range_starts[first:stop], batch_counts) + offsets
+        first = stop
+
+def find_overlapping_segment_pairs(
+        starts: npt.NDArray[np.floating],
+        ends: npt.NDArray[np.floating],
+        ) -> Iterator[Iterator[tuple[npt.NDArray[np.int64], npt.NDArray[np.int64]]]]:
+    # (later, earlier) indices of the segments whose bounding boxes overlap, the only ones that can intersect.
+    # they come in chunks of whole later segments in index order, so a search for the first crossing can stop
+    # after the chunk it is found in; every chunk is a series of batches of pairs
+    count = len(starts)
+    if count < 2:
+        return
+    lows = np.minimum(starts, ends)
+    highs = np.maximum(starts, ends)
+
+    # overlaps are found along the axis the segments cover less of, every segment only meets the few
+    # that start within its extent or reach into it from before
+    coverage = (highs - lows).sum(axis=0) / np.maximum(highs.max(axis=0) - lows.min(axis=0), np.finfo(np.float64).tiny)
+    axis = int(np.argmin(coverage))
+    other = 1 - axis
+    order = np.argsort(lows[:, axis], kind='stable')
+    sorted_lows = lows[order, axis]
+
+    def chunk_pairs(chunk_start: int, chunk_stop: int) -> Iterator[tuple[npt.NDArray[np.int64], npt.NDArray[np.int64]]]:
+        members = np.arange(chunk_start, chunk_stop)
+        # segments starting within a member's extent
+        batches = (
+            (later, order[positions]) for later, positions in expand_ranges(
+                members,
+                np.searchsorted(sorted_lows, lows[members, axis], side='left'),
+                np.searchsorted(sorted_lows, highs[members, axis], side='right')))
+        for later, earlier in batches:
+            kept = (earlier < later) & (lows[later, other] <= highs[earlier, other]) \
+                & (lows[earlier, other] <= highs[later, other])
+            yield later[kept], earlier[kept]
+
+        # earlier segments starting before a member and reaching into it
+        member_order = members[np.argsort(lows[members, axis], kind='stable')]
+        member_lows = lows[member_order, axis]
+        candidates = np.arange(chunk_stop - 1)
+        batches = (
+            (earlier, member_order[positions]) for earlier, positions in expand_ranges(
+                candidates,
+                np.searchsorted(member_lows, lows[candidates, axis], side='right'),
+                np.searchsorted(member_lows, highs[candidates, axis], side='right')))
+        for earlier, later in batches:
+            kept = (earlier < later) & (lows[later, other] <= highs[earlier, other]) \
+                & (lows[earlier, other] <= highs[later, other])
+            yield later[kept], earlier[kept]
+
+    # small chunks first, most strokes cross themselves early on if at all
+    chunk_start = 0
+    chunk_size = FIRST_SEGMENT_CHUNK
+    while chunk_start < count:
+        chunk_stop = min(chunk_start + chunk_size, count)
+        yield chunk_pairs(chunk_start, chunk_stop)
+        chunk_start = chunk_stop
+        chunk_size *= 2
+
+def find_2d_shape_loop(
+        points: list[npt.NDArray[np.float64]],
+        ) -> Optional[tuple[int, int, tuple[float, float, npt.NDArray[np.float64]]]]:
+    # first and last index of the first loop in points and the get_intersection_point result where
+    # it crosses itself (along the last segment, along the first segment, point), None if it never does
+    if len(points) < 4:
+        return None
+
+    # segment i runs from point i - 1 to point i; the loop ends at the first segment that crosses an earlier one
+    # (not counting the one right before it, they always meet at the endpoint) and starts at the first one it crosses
+    positions = np.array(points)
+    for chunk in find_overlapping_segment_pairs(positions[:-1], positions[1:]):
+        # pairs as later * len(positions) + earlier, so the smallest is the first loop
+        first_pair = None
+        for later, earlier in chunk:
+            later = later + 1
+            earlier = earlier + 1
+            not_adjacent = earlier < later - 1
+            later = later[not_adjacent]
+            earlier = earlier[not_adjacent]
+
+            # the same test as get_intersection_point for all candidate pairs at once
+            m1 = positions[later] - positions[later - 1]
+            b1 = positions[later - 1]
+            m2 = positions[earlier] - positions[earlier - 1]
+            b2 = positions[earlier - 1]
+            denom = m2[:, 0] * m1[:, 1] - m1[:, 0] * m2[:, 1]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                det = 1.0 / denom
+                b2b1 = b2 - b1
+                t1 = det * (m2[:, 0] * b2b1[:, 1] - m2[:, 1] * b2b1[:, 0])
+                t2 = det * (m1[:, 0] * b2b1[:, 1] - m1[:, 1] * b2b1[:, 0])
+            # parallel lines give nan or inf here, which fails every comparison
+            intersecting = (denom != 0) & (t1 >= 0.0) & (t1 <= 1.0) & (t2 >= 0.0) & (t2 <= 1.0)
+            if intersecting.any():
+                pair = int((later * len(positions) + earlier)[intersecting].min())
+                first_pair = pair if first_pair is None else min(first_pair, pair)
+        if first_pair is not None:
+            # chunks are in the order of the later segment, so no later chunk has an earlier loop
+            i, j = divmod(first_pair, len(positions))
+            return j - 1, i, get_intersection_point((points[i-1], points[i]), (points[j-1], points[j]))
+    return None
+
 def close_2d_shape(points: Iterable[npt.NDArray[np.float64]]) -> list[npt.NDArray[np.float64]]:
     # close the loop temporarily by adding a closing edge
     points = list(points)
     points.append(points[0])
-    
-    # can't do anything on the first point
-    for i in range(1, len(points)):
-        # scan every segment up to i for an intersection
-        # + don't check segment before i because that will
-        # always be connected at the endpoint
-        # also can't do anything on the first line segment
-        for j in range(1, i - 1):
-            intersection_point = get_intersection_point(
-                (points[i-1], points[i]), (points[j-1], points[j]))
-            if not intersection_point:
-                # lines are parallel
-                continue
-            int_t1, int_t2, int_point = intersection_point
-            if int_t1 < 0.0 or int_t1 > 1.0 or int_t2 < 0.0 or int_t2 > 1.0:
-                # lines intersect outside range
-                continue
-            # an intersection was found!
-            # set the last point in the loop to this intersection
-            points[i] = int_point
-            # set the first point in the loop to this intersection
-            points[j-1] = int_point
-            # return only the points in the loop
-            return points[j-1:i+1]
-    # there was no intersection found, so the basic loop can be returned
-    return points
+
+    loop = find_2d_shape_loop(points)
+    if loop is None:
+        # there was no intersection found, so the basic loop can be returned
+        return points
+    # set the first and last point in the loop to the intersection and return only the points in the loop
+    first, last, (_, _, int_point) = loop
+    points[last] = int_point
+    points[first] = int_point
+    return points[first:last+1]
+
+def close_weighted_2d_shape(
+        points: Iterable[npt.NDArray[np.float64]],
+        span_weights: npt.NDArray[np.float64],
+        ) -> tuple[list[npt.NDArray[np.float64]], npt.NDArray[np.float64]]:
+    # close_2d_shape for strokes from simplify_stroke, also returns the center the closed shape
+    # would have had before simplifying (the mean of the drawn points in the loop)
+    points = list(points)
+    points.append(points[0])
+    # the closing point is a single copy of the first drawn point
+    span_weights = np.concatenate([span_weights, [[0.0, 1.0]]])
+    positions = np.asarray(points, dtype=np.float64)
+    starts = span_weights[:, 0:1] * positions[:-1]
+    ends = span_weights[:, 1:2] * positions[1:]
+
+    loop = find_2d_shape_loop(points)
+    if loop is None:
+        return points, (starts + ends).sum(axis=0) / span_weights.sum()
+
+    first, last, (t_last, t_first, int_point) = loop
+    # the two spans cut by the intersection only count their part inside the loop, taken as evenly spread
+    first_count = span_weights[first].sum() * (1.0 - t_first)
+    last_count = span_weights[last - 1].sum() * t_last
+    total = (starts + ends)[first + 1:last - 1].sum(axis=0) \
+        + first_count * (int_point + positions[first + 1]) / 2.0 \
+        + last_count * (positions[last - 1] + int_point) / 2.0
+    count = span_weights[first + 1:last - 1].sum() + first_count + last_count
+
+    points[last] = int_point
+    points[first] = int_point
+    return points[first:last+1], total / count
 
 def find_2d_shape_center(points: list[npt.NDArray[np.float64]]) -> npt.NDArray[np.float64]:
     return sum(points, start=np.array([0.0, 0.0])) / len(points)
@@ -284,17 +629,122 @@ def find_value_inside_shape(
     # ray does not have a bounding point
     return None
 
+# upper bound on pixels * segments evaluated at once by rasterize_shape
+RASTERIZE_CHUNK_SIZE = 1 << 22
+
+def rasterize_shape(
+        width: int,
+        height: int,
+        shape_points: list[npt.NDArray[np.float64]],
+        dtype: npt.DTypeLike = np.float32,
+        tile: Optional[Tile] = None,
+        center: Optional[npt.NDArray[np.float64]] = None,
+        ) -> ShapeCoverage:
+    # batched version of find_value_inside_shape over the pixels of the shape's bounding box,
+    # clipped to tile if one is given and computed in dtype; center defaults to the mean of the points
+    if tile is None:
+        tile = Tile(0, 0, width, height)
+    points = np.asarray(shape_points, dtype=dtype)
+    center = points.mean(axis=0) if center is None else np.asarray(center, dtype=dtype)
+    max_distance_squared = ((points - center) ** 2).sum(axis=1).max()
+    max_distance = np.sqrt(max_distance_squared)
+
+    # every pixel with a bounding segment further along its ray lies inside the bounding box,
+    # and the box can be shrunk further by the radius check
+    low = np.maximum(points.min(axis=0), center - max_distance)
+    high = np.minimum(points.max(axis=0), center + max_distance)
+    x_start = max(int(np.ceil(low[0] * width)), tile.x_start)
+    x_stop = min(int(np.floor(high[0] * width)) + 1, tile.x_stop)
+    y_start = max(int(np.ceil(low[1] * height)), tile.y_start)
+    y_stop = min(int(np.floor(high[1] * height)) + 1, tile.y_stop)
+    if x_stop <= x_start or y_stop <= y_start:
+        return ShapeCoverage(x_start=0, y_start=0, values=np.empty((0, 0), dtype=dtype))
+
+    values = np.full((y_stop - y_start, x_stop - x_start), np.nan, dtype=dtype)
+    x_positions = (np.arange(x_start, x_stop) / width).astype(dtype)
+    y_positions = (np.arange(y_start, y_stop) / height).astype(dtype)
+
+    segment_vectors = points[1:] - points[:-1]
+    segment_offsets = points[:-1] - center
+    # the ray always starts at the center, so the ray parameter numerator is per segment only
+    t1_numerators = segment_vectors[:, 0] * segment_offsets[:, 1] - segment_vectors[:, 1] * segment_offsets[:, 0]
+
+    if KERNEL_BACKEND == 'NUMBA':
+        trace_shape_rays(x_positions, y_positions, center, segment_vectors, segment_offsets, t1_numerators,
+                         max_distance_squared, points.dtype.type(1.0), values)
+        return ShapeCoverage(x_start=x_start, y_start=y_start, values=values)
+
+    segment_count = max(len(segment_vectors), 1)
+    rows_per_chunk = max(RASTERIZE_CHUNK_SIZE // (segment_count * len(x_positions)), 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for chunk_start in range(0, len(y_positions), rows_per_chunk):
+            chunk_y = y_positions[chunk_start:chunk_start + rows_per_chunk]
+            ray_x = np.tile(x_positions, len(chunk_y)) - center[0]
+            ray_y = np.repeat(chunk_y, len(x_positions)) - center[1]
+
+            denom = segment_vectors[:, 0] * ray_y[:, None] - ray_x[:, None] * segment_vectors[:, 1]
+            det = 1.0 / denom
+            t1 = det * t1_numerators
+            t2 = det * (ray_x[:, None] * segment_offsets[:, 1] - ray_y[:, None] * segment_offsets[:, 0])
+
+            # ray must be shorter than the collision vector and hit within the segment
+            valid = (denom != 0) & (t1 > 1.0) & (t2 >= 0.0) & (t2 <= 1.0)
+            first_valid = valid.argmax(axis=1)
+            hit = valid[np.arange(len(ray_x)), first_valid]
+            hit &= ray_x ** 2 + ray_y ** 2 <= max_distance_squared
+            ratio = 1.0 / t1[np.arange(len(ray_x)), first_valid]
+
+            values[chunk_start:chunk_start + len(chunk_y)] = \
+                np.where(hit, ratio, np.nan).reshape(len(chunk_y), len(x_positions))
+
+    return ShapeCoverage(x_start=x_start, y_start=y_start, values=values)
+
 def build_gaussian_kernel(size: int) -> npt.NDArray[np.float64]:
-    # pascal's triangle is apparently a good approximation for this
-    kernel = np.array([0.0] * size)
-    kernel[0] = 1.0
-    for i in range(1, size):
-        kernel[i] = kernel[i - 1] * ((size - i) / i)
-    return kernel / 2 ** (size - 1)
+    # sampled so that +-3 standard deviations span the kernel, like a box of the same size
+    sigma = max(size / 6.0, 1e-6)
+    offsets = np.arange(size) - (size - 1) / 2.0
+    kernel = np.exp(-0.5 * (offsets / sigma) ** 2)
+    return kernel / kernel.sum()
 
 def build_box_kernel(size: int) -> npt.NDArray[np.float64]:
     return np.array([1.0 / size] * size)
 
+def build_image_buffer(image_pixels: npt.NDArray[np.floating], channels: int = 4) -> npt.NDArray[np.float32]:
+    # flat float32 buffer in blender's pixel layout, gray in every color channel and opaque alpha
+    has_alpha = channels in (2, 4)
+    buffer = np.empty((len(image_pixels), channels), dtype=np.float32)
+    buffer[:, :channels - has_alpha] = np.asarray(image_pixels)[:, None]
+    if has_alpha:
+        buffer[:, -1] = 1.0
+    return buffer.reshape(-1)
+
+def pack_mirrored_channel(
+        pixel_buffer: npt.NDArray[np.float32],
+        width: int,
+        channels: int,
+        cells: Optional[list[Tile]] = None,
+        ) -> npt.NDArray[np.float32]:
+    # overwrites the second channel of a buffer from build_image_buffer with the map mirrored left to right,
+    # so the material gets both sides of the face from one texture fetch; atlas cells are each mirrored in place
+    pixels = pixel_buffer.reshape(-1, width, channels)
+    for cell in cells or [Tile(0, 0, width, len(pixels))]:
+        rows, columns = cell.slices()
+        pixels[rows, columns, 1] = pixels[rows, columns, 0][:, ::-1]
+    return pixel_buffer
+
+def resize_bilinear(image_2d: npt.NDArray[np.floating], width: int, height: int) -> npt.NDArray[np.floating]:
+    # pixel centers of the output are mapped onto the input, edges are clamped
+    def axis_weights(source_size: int, target_size: int) -> tuple[npt.NDArray, npt.NDArray, npt.NDArray]:
+        positions = np.clip((np.arange(target_size) + 0.5) * source_size / target_size - 0.5, 0.0, source_size - 1)
+        lower = np.floor(positions).astype(np.int64)
+        upper = np.minimum(lower + 1, source_size - 1)
+        return lower, upper, (positions - lower).astype(image_2d.dtype)
+
+    x_lower, x_upper, x_weights = axis_weights(image_2d.shape[1], width)
+    rows = image_2d[:, x_lower] * (1 - x_weights) + image_2d[:, x_upper] * x_weights
+    y_lower, y_upper, y_weights = axis_weights(image_2d.shape[0], height)
+    return rows[y_lower] * (1 - y_weights[:, None]) + rows[y_upper] * y_weights[:, None]
+
 def get_first_non_empty_array(arrays: list[list]) -> Optional[list]:
     for array in arrays:
         if array:
@@ -302,4 +752,6 @@ def get_first_non_empty_array(arrays: list[list]) -> Optional[list]:
     return None
 
 def find_average_x_value(points: list[npt.NDArray[np.float64]]) -> float:
+    if len(points) == 0:
+        return 0.0
     return sum([point[0] for point in points]) / len(points)
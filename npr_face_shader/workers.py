@@ -0,0 +1,203 @@
+from typing import Optional, Any, Callable
+from dataclasses import dataclass, fields, is_dataclass, replace
+from multiprocessing import shared_memory, resource_tracker
+from multiprocessing.pool import Pool
+import os
+import sys
+import time
+import uuid
+
+import numpy as np
+import numpy.typing as npt
+
+# chunks handed to each worker per pool.map, more means better balancing
+CHUNKS_PER_WORKER = 8
+
+_pool: Optional[Pool] = None
+
+# blocks attached inside this (worker) process, released once a newer session shows up
+_attached_blocks: dict[str, shared_memory.SharedMemory] = {}
+_attached_session: Optional[str] = None
+
+# seconds the workers spent inside tasks, summed over every map so far
+_worker_busy_time = 0.0
+
+
+def get_worker_count() -> int:
+    return os.cpu_count() or 1
+
+def get_worker_pool() -> Pool:
+    # created on first use and reused by every following bake
+    global _pool
+    if _pool is None:
+        if os.name == 'posix':
+            # forked workers would otherwise start trackers of their own and unlink shared blocks on exit
+            resource_tracker.ensure_running()
+        _pool = Pool(processes=get_worker_count())
+    return _pool
+
+def get_worker_busy_time() -> float:
+    return _worker_busy_time
+
+def add_worker_busy_time(seconds: float) -> None:
+    global _worker_busy_time
+    _worker_busy_time += seconds
+
+def close_worker_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.terminate()
+        _pool.join()
+        _pool = None
+
+
+@dataclass
+class SharedArray:
+    # picklable handle to an array living in shared memory
+    name: str
+    session: str
+    shape: tuple[int, ...]
+    dtype: str
+
+
+class SharedMemoryBlocks:
+    # owns every block created for one session and unlinks them on exit
+
+    def __init__(self):
+        self.session = uuid.uuid4().hex
+        self.blocks: dict[str, shared_memory.SharedMemory] = {}
+
+    def __enter__(self) -> 'SharedMemoryBlocks':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def empty(self, shape: tuple[int, ...], dtype: npt.DTypeLike = np.float64) -> SharedArray:
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape)) * dtype.itemsize
+        block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.blocks[block.name] = block
+        return SharedArray(name=block.name, session=self.session, shape=tuple(shape), dtype=dtype.str)
+
+    def full(self, shape: tuple[int, ...], value: float, dtype: npt.DTypeLike = np.float64) -> SharedArray:
+        handle = self.empty(shape, dtype)
+        self.array(handle).fill(value)
+        return handle
+
+    def share(self, array: npt.NDArray) -> SharedArray:
+        handle = self.empty(array.shape, array.dtype)
+        self.array(handle)[...] = array
+        return handle
+
+    def share_fields(self, obj: Any) -> Any:
+        # copy of a dataclass with every array field moved into shared memory
+        if obj is None or not is_dataclass(obj):
+            return obj
+        return replace(obj, **{
+            field.name: self.share(getattr(obj, field.name))
+            for field in fields(obj)
+            if isinstance(getattr(obj, field.name), np.ndarray)
+        })
+
+    def array(self, handle: SharedArray) -> npt.NDArray:
+        return np.ndarray(handle.shape, dtype=handle.dtype, buffer=self.blocks[handle.name].buf)
+
+    def close(self) -> None:
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks.clear()
+
+
+def open_shared_memory(name: str) -> shared_memory.SharedMemory:
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    # workers share the parent's resource tracker, so attaching again only repeats its registration
+    return shared_memory.SharedMemory(name=name)
+
+def release_attached_blocks() -> None:
+    for block in _attached_blocks.values():
+        try:
+            block.close()
+        except BufferError:
+            # something from the old session is still referenced, leave it to the gc
+            pass
+    _attached_blocks.clear()
+
+def attach_shared_array(handle: SharedArray) -> npt.NDArray:
+    global _attached_session
+    if handle.session != _attached_session:
+        release_attached_blocks()
+        _attached_session = handle.session
+    block = _attached_blocks.get(handle.name)
+    if block is None:
+        block = open_shared_memory(handle.name)
+        _attached_blocks[handle.name] = block
+    return np.ndarray(handle.shape, dtype=handle.dtype, buffer=block.buf)
+
+def attach_fields(obj: Any) -> Any:
+    # inverse of SharedMemoryBlocks.share_fields, objects without shared fields pass through
+    if obj is None or not is_dataclass(obj):
+        return obj
+    shared = {
+        field.name: attach_shared_array(getattr(obj, field.name))
+        for field in fields(obj)
+        if isinstance(getattr(obj, field.name), SharedArray)
+    }
+    return replace(obj, **shared) if shared else obj
+
+
+@dataclass
+class PixelWriter:
+    # runs a per-pixel calculator over a range of indices and writes straight into shared memory
+    calculator: Callable[[int], Optional[float]]
+    output: SharedArray
+
+    def __call__(self, indices: range) -> float:
+        # returns the time spent, for utilization stats
+        start = time.perf_counter()
+        output = attach_shared_array(self.output)
+        for index in indices:
+            value = self.calculator(index)
+            output[index] = np.nan if value is None else value
+        return time.perf_counter() - start
+
+
+@dataclass
+class TimedCall:
+    # wraps a task so it also returns how long it ran
+    function: Callable[[Any], Any]
+
+    def __call__(self, item: Any) -> tuple[Any, float]:
+        start = time.perf_counter()
+        result = self.function(item)
+        return result, time.perf_counter() - start
+
+def split_range(count: int, chunk_count: int) -> list[range]:
+    chunk_size = max(-(-count // max(chunk_count, 1)), 1)
+    return [range(start, min(start + chunk_size, count)) for start in range(0, count, chunk_size)]
+
+def map_pixels(
+        pool: Pool,
+        calculator: Callable[[int], Optional[float]],
+        pixel_count: int,
+        dtype: npt.DTypeLike = np.float64,
+        ) -> npt.NDArray[np.floating]:
+    # pixels the calculator returns None for come back as nan
+    with SharedMemoryBlocks() as shared:
+        output = shared.full((pixel_count,), np.nan, dtype)
+        chunks = split_range(pixel_count, get_worker_count() * CHUNKS_PER_WORKER)
+        busy_times = pool.map(PixelWriter(calculator, output), chunks, chunksize=1)
+        add_worker_busy_time(sum(busy_times))
+        return shared.array(output).copy()
+
+def map_shared(pool: Pool, function: Any, shared_field_names: list[str], items: list[Any]) -> list[Any]:
+    # the named dataclass fields of function are moved into shared memory for the duration of the map
+    with SharedMemoryBlocks() as shared:
+        shared_function = replace(function, **{
+            name: shared.share_fields(getattr(function, name)) for name in shared_field_names
+        })
+        results = pool.map(TimedCall(shared_function), items)
+        add_worker_busy_time(sum(busy_time for _, busy_time in results))
+        return [result for result, _ in results]